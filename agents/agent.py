@@ -1,9 +1,12 @@
 import logging
 
+from PaperAgent.agents import metrics
+
 class Agent:
     """
     An abstract superclass for Agents
-    Used to log messages in a way that can identify each Agent
+    Used to log messages in a way that can identify each Agent,
+    and to time and count its work in the shared metrics registry
     """
 
     # Foreground colors
@@ -24,10 +27,25 @@ class Agent:
     name: str = ""
     color: str = '\033[37m'
 
-    def log(self, message):
+    def log(self, message, *args):
         """
         Log this as an info message, identifying the agent
+        Nothing is formatted when INFO is disabled; pass %-style args to defer formatting the message too
         """
+        if not logging.getLogger().isEnabledFor(logging.INFO):
+            return
         color_code = self.BG_BLACK + self.color
         message = f"[{self.name}] {message}"
-        logging.info(color_code + message + self.RESET)
\ No newline at end of file
+        logging.info(color_code + message + self.RESET, *args)
+
+    def span(self, operation: str):
+        """
+        Time a block of this agent's work:  with self.span("fetch"): ...
+        """
+        return metrics.span(operation, agent=self.name)
+
+    def count(self, counter: str, value: float = 1, **labels):
+        """
+        Add to one of this agent's counters, e.g. tokens, requests or cache hits
+        """
+        metrics.increment(counter, value, agent=self.name, **labels)
\ No newline at end of file
@@ -0,0 +1,90 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+
+class MicroBatcher:
+    """
+    Turn many concurrent single-item calls into a few batched ones
+    Items submitted within `max_wait` seconds of the first item of a batch, up to `max_batch_size`,
+    are sent to `fn` together, and each caller gets back its own result
+    """
+
+    def __init__(self, fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 32, max_wait: float = 0.02):
+        """
+        :param fn: takes a list of items and returns a list of results in the same order
+        """
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._loop, daemon=True, name="micro-batcher")
+        self.thread.start()
+
+    def submit(self, item) -> Future:
+        if self.closed:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        self.queue.put((item, future))
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                # Leave the close marker for the loop, after this batch is dispatched
+                self.queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            items = [item for item, _ in batch]
+            try:
+                results = self.fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"Batch function returned {len(results)} results for {len(items)} items")
+            except BaseException as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(items)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def close(self) -> None:
+        """
+        Stop the batching thread once the items already submitted have been dispatched
+        """
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,158 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import re
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+from PaperAgent.agents.agent import Agent
+from PaperAgent.agents.embeddings import get_embedding_service
+
+CITATION_MODEL_PATH = os.getenv("CITATION_MODEL_PATH", "citation_model.pkl")
+
+_YEAR = re.compile(r"^Year: (\d{4})", re.MULTILINE)
+_ABSTRACT = re.compile(r"^Abstract: (.*?)\nNumber of citations:", re.MULTILINE | re.DOTALL)
+
+
+class CitationPredictor(Agent):
+    """
+    Predict the citation count of papers locally, from the year and abstract in Paper.make_model_input
+    and the MiniLM embedding of the abstract, with a ridge regression on log citations
+    A batch is one embedding lookup (usually cached by the pre-ranker) and one matrix product
+    """
+
+    name = "Citation Predictor"
+    color = Agent.YELLOW
+
+    def __init__(self, path: str = CITATION_MODEL_PATH, regression=None):
+        """
+        :param path: where the trained model is saved and loaded from
+        :param regression: use this fitted regressor instead of loading the model at path
+        """
+        self.path = path
+        self.embeddings = get_embedding_service()
+        if regression is None and os.path.exists(path):
+            import joblib
+            regression = joblib.load(path)
+            self.log(f"Citation Predictor loaded {path}")
+        self.regression = regression
+
+    @property
+    def trained(self) -> bool:
+        return self.regression is not None
+
+    @staticmethod
+    def parse(model_input: str) -> Tuple[Optional[int], str]:
+        """
+        Recover the year and abstract from a Paper.make_model_input string
+        """
+        year = _YEAR.search(model_input)
+        abstract = _ABSTRACT.search(model_input)
+        return (int(year.group(1)) if year else None), (abstract.group(1).strip() if abstract else "")
+
+    def features(self, model_inputs: Sequence[str]) -> np.ndarray:
+        """
+        One row per paper: years since publication, whether the year is known, log abstract length,
+        then the normalized abstract embedding
+        """
+        parsed = [self.parse(text) for text in model_inputs]
+        this_year = datetime.date.today().year
+        years = np.array([year or 0 for year, _ in parsed], dtype=np.float32)
+        known = (years > 0).astype(np.float32)
+        age = np.where(known > 0, np.maximum(this_year - years, 0), 0).astype(np.float32)
+        length = np.log1p([len(abstract.split()) for _, abstract in parsed]).astype(np.float32)
+        vectors = self.embeddings.encode_many([abstract for _, abstract in parsed])
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return np.hstack([age[:, None], known[:, None], length[:, None], vectors])
+
+    def train(self, model_inputs: List[str], citations: List[int], alpha: float = 1.0, holdout: float = 0.1,
+              seed: int = 42) -> dict:
+        """
+        Fit the regression on log(1 + citations), report it on a held-out split, then refit on everything and save it
+        :return: the held-out mean absolute error (in log citations) and R^2
+        """
+        import joblib
+        from sklearn.linear_model import Ridge
+        X = self.features(model_inputs)
+        y = np.log1p(np.maximum(np.asarray(citations, dtype=np.float64), 0))
+        order = np.random.default_rng(seed).permutation(len(y))
+        split = int(len(y) * holdout)
+        report = {"train": len(y) - split, "holdout": split}
+        if split:
+            test, fit = order[:split], order[split:]
+            predicted = Ridge(alpha=alpha).fit(X[fit], y[fit]).predict(X[test])
+            residual = ((y[test] - predicted) ** 2).sum()
+            total = ((y[test] - y[test].mean()) ** 2).sum()
+            report["mae_log"] = float(np.abs(y[test] - predicted).mean())
+            report["r2"] = float(1 - residual / total) if total else 0.0
+        self.regression = Ridge(alpha=alpha).fit(X, y)
+        joblib.dump(self.regression, self.path)
+        self.log(f"Citation Predictor trained on {len(y)} papers and saved to {self.path}")
+        return report
+
+    def predict_inputs(self, model_inputs: Sequence[str]) -> np.ndarray:
+        """
+        Predicted citation counts for a batch of make_model_input strings
+        """
+        if not self.trained:
+            raise RuntimeError(f"Citation Predictor has no model - train one first or check {self.path}")
+        if not len(model_inputs):
+            return np.zeros(0, dtype=np.float32)
+        return np.maximum(np.expm1(self.regression.predict(self.features(model_inputs))), 0)
+
+    def predict(self, papers) -> np.ndarray:
+        """
+        Predicted citation counts for a list of papers or a PaperBatch, in one vectorized pass
+        """
+        if hasattr(papers, "make_model_inputs"):
+            return self.predict_inputs(papers.make_model_inputs())
+        return self.predict_inputs([paper.make_model_input() for paper in papers])
+
+
+def read_pairs(path: str) -> Tuple[List[str], List[int]]:
+    """
+    Read the JSON-lines training pairs written by CorpusStore.export_training_pairs
+    """
+    texts, citations = [], []
+    with open(path) as f:
+        for line in f:
+            pair = json.loads(line)
+            texts.append(pair["text"])
+            citations.append(pair["citations"])
+    return texts, citations
+
+
+# RUN: python -m PaperAgent.agents.corpus export training.jsonl
+#      python -m PaperAgent.agents.citation_predictor train training.jsonl
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train or try the local citation predictor")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train = commands.add_parser("train", help="fit the model on exported training pairs")
+    train.add_argument("pairs", nargs="?", help="a JSON-lines file of training pairs; defaults to the whole corpus")
+    train.add_argument("--corpus", help="read the pairs straight from this corpus database instead")
+    train.add_argument("--output", default=CITATION_MODEL_PATH)
+    train.add_argument("--alpha", type=float, default=1.0, help="ridge regularization strength")
+    train.add_argument("--holdout", type=float, default=0.1, help="fraction of pairs held out for the report")
+    predict = commands.add_parser("predict", help="predict the citations of papers fetched for a query")
+    predict.add_argument("query")
+    predict.add_argument("--model", default=CITATION_MODEL_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "train":
+        if args.pairs:
+            texts, citations = read_pairs(args.pairs)
+        else:
+            from PaperAgent.agents.corpus import CORPUS_PATH, CorpusStore
+            pairs = list(CorpusStore(args.corpus or CORPUS_PATH).iter_training_pairs())
+            texts, citations = [text for text, _ in pairs], [count for _, count in pairs]
+        predictor = CitationPredictor(args.output)
+        print(json.dumps(predictor.train(texts, citations, alpha=args.alpha, holdout=args.holdout), indent=2))
+    else:
+        from PaperAgent.agents.papers import Paper
+        predictor = CitationPredictor(args.model)
+        papers = [paper for paper in Paper.fetch(args.query, limit=20) if paper.abstract]
+        for paper, estimate in zip(papers, predictor.predict(papers)):
+            print(f"{estimate:8.1f}  {paper.title[:100]}")
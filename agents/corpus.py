@@ -0,0 +1,283 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from PaperAgent.agents.papers import Paper
+
+CORPUS_PATH = os.getenv("PAPER_CORPUS_PATH", "cache/corpus.sqlite")
+
+_COLUMNS = "paper_id, title, abstract, url, year, publication_date, citations"
+_WORD = re.compile(r"\w+")
+
+
+class CorpusStore:
+    """
+    A persistent local corpus of every paper fetched, in SQLite
+    Papers are indexed by paper_id, year and citation count, with a full-text index over title and abstract;
+    each fetched search page is remembered too, so repeated queries are answered locally
+    and only pages never fetched (or too old) go to the API
+    """
+
+    def __init__(self, path: str = CORPUS_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS papers ("
+            "id INTEGER PRIMARY KEY, paper_id TEXT NOT NULL UNIQUE, title TEXT NOT NULL, abstract TEXT NOT NULL, "
+            "url TEXT NOT NULL, year INTEGER, publication_date TEXT, citations INTEGER NOT NULL, fetched REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS papers_year ON papers (year)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS papers_citations ON papers (citations)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "query TEXT NOT NULL, page INTEGER NOT NULL, page_limit INTEGER NOT NULL, year TEXT NOT NULL, "
+            "paper_ids TEXT NOT NULL, fetched REAL NOT NULL, PRIMARY KEY (query, page, page_limit, year))"
+        )
+        self.fts = self._create_fts()
+        self.conn.commit()
+
+    def _create_fts(self) -> bool:
+        """
+        Set up the FTS5 index, kept in sync by triggers; without FTS5, search falls back to LIKE
+        """
+        try:
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(title, abstract, content='papers', content_rowid='id')"
+            )
+        except sqlite3.OperationalError:
+            return False
+        self.conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS papers_ai AFTER INSERT ON papers BEGIN
+                INSERT INTO papers_fts (rowid, title, abstract) VALUES (new.id, new.title, new.abstract);
+            END;
+            CREATE TRIGGER IF NOT EXISTS papers_ad AFTER DELETE ON papers BEGIN
+                INSERT INTO papers_fts (papers_fts, rowid, title, abstract) VALUES ('delete', old.id, old.title, old.abstract);
+            END;
+            CREATE TRIGGER IF NOT EXISTS papers_au AFTER UPDATE OF title, abstract ON papers BEGIN
+                INSERT INTO papers_fts (papers_fts, rowid, title, abstract) VALUES ('delete', old.id, old.title, old.abstract);
+                INSERT INTO papers_fts (rowid, title, abstract) VALUES (new.id, new.title, new.abstract);
+            END;
+        """)
+        return True
+
+    @staticmethod
+    def _normalize(query: str) -> str:
+        return " ".join(query.split()).lower()
+
+    @staticmethod
+    def _key(record: Dict) -> Optional[str]:
+        return record.get("paperId") or record.get("url") or None
+
+    @staticmethod
+    def _record(row: Tuple) -> Dict:
+        """
+        A stored row in the shape of a Semantic Scholar search record
+        """
+        paper_id, title, abstract, url, year, publication_date, citations = row
+        return {"paperId": paper_id, "title": title, "abstract": abstract, "url": url, "year": year,
+                "publicationDate": publication_date, "citationCount": citations}
+
+    def add_records(self, records: List[Dict]) -> None:
+        """
+        Store raw search records; a paper already in the corpus only has its citation count refreshed
+        """
+        now = time.time()
+        rows = [
+            (self._key(r), r.get("title") or "", r.get("abstract") or "", r.get("url") or "", r.get("year"),
+             r.get("publicationDate"), r.get("citationCount") if r.get("citationCount") is not None else -1, now)
+            for r in records if self._key(r)
+        ]
+        with self.lock:
+            self.conn.executemany(
+                f"INSERT INTO papers ({_COLUMNS}, fetched) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(paper_id) DO UPDATE SET citations = excluded.citations, fetched = excluded.fetched",
+                rows,
+            )
+            self.conn.commit()
+
+    def add_many(self, papers: List[Paper]) -> None:
+        self.add_records([
+            {"paperId": p.paper_id, "title": p.title, "abstract": p.abstract, "url": p.url,
+             "year": int(p.published) if p.published and p.published.isdigit() else None,
+             "publicationDate": p.publication_date, "citationCount": p.citations}
+            for p in papers
+        ])
+
+    def get(self, paper_ids: List[str]) -> List[Dict]:
+        """
+        The stored records for these ids, in the same order; ids not in the corpus are skipped
+        """
+        found = {}
+        with self.lock:
+            for start in range(0, len(paper_ids), 500):
+                chunk = paper_ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT {_COLUMNS} FROM papers WHERE paper_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update((row[0], row) for row in rows)
+        return [self._record(found[paper_id]) for paper_id in paper_ids if paper_id in found]
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+
+    def page(self, query: str, page: int, limit: int, year: str, max_age: Optional[float] = None) -> Optional[List[Dict]]:
+        """
+        A search page fetched earlier, or None if it was never fetched or is older than max_age seconds
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT paper_ids, fetched FROM pages WHERE query = ? AND page = ? AND page_limit = ? AND year = ?",
+                (self._normalize(query), page, limit, str(year)),
+            ).fetchone()
+        if row is None or (max_age is not None and time.time() - row[1] > max_age):
+            return None
+        return self.get(json.loads(row[0]))
+
+    def add_page(self, query: str, page: int, limit: int, year: str, records: List[Dict]) -> None:
+        self.add_records(records)
+        paper_ids = [self._key(record) for record in records if self._key(record)]
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages (query, page, page_limit, year, paper_ids, fetched) VALUES (?, ?, ?, ?, ?, ?)",
+                (self._normalize(query), page, limit, str(year), json.dumps(paper_ids), time.time()),
+            )
+            self.conn.commit()
+
+    def fetch_records(self, query: str, page: int = 0, limit: int = 100, year="2024-2024",
+                      max_age: Optional[float] = None) -> List[Dict]:
+        """
+        Corpus-first counterpart of Paper.fetch_papers_batch: a stored page is returned without calling the API,
+        a new page is fetched and stored, and a stale page is refreshed - or served as is if the API fails
+        :param max_age: seconds after which a stored page is fetched again; None keeps pages forever
+        """
+        records = self.page(query, page, limit, year, max_age)
+        if records is not None:
+            return records
+        records = Paper.fetch_papers_batch(query, page, limit, year, use_cache=False)
+        if records:
+            self.add_page(query, page, limit, year, records)
+            return records
+        return self.page(query, page, limit, year) or []
+
+    def fetch(self, query: str, page: int = 0, limit: int = 100, year="2024-2024",
+              max_age: Optional[float] = None) -> List[Paper]:
+        return [Paper.from_api(record) for record in self.fetch_records(query, page, limit, year, max_age)]
+
+    def search(self, text: str, limit: int = 100, offset: int = 0, year_from: Optional[int] = None,
+               year_to: Optional[int] = None, min_citations: Optional[int] = None) -> List[Paper]:
+        """
+        Full-text search of the stored titles and abstracts, best matches first
+        """
+        words = _WORD.findall(text.lower())
+        if not words:
+            return []
+        filters, params = [], []
+        if year_from is not None:
+            filters.append("p.year >= ?")
+            params.append(year_from)
+        if year_to is not None:
+            filters.append("p.year <= ?")
+            params.append(year_to)
+        if min_citations is not None:
+            filters.append("p.citations >= ?")
+            params.append(min_citations)
+        columns = ", ".join(f"p.{column.strip()}" for column in _COLUMNS.split(","))
+        if self.fts:
+            match = " OR ".join(f'"{word}"' for word in words)
+            where = " AND ".join(["papers_fts MATCH ?"] + filters)
+            sql = (f"SELECT {columns} FROM papers_fts JOIN papers p ON p.id = papers_fts.rowid "
+                   f"WHERE {where} ORDER BY bm25(papers_fts) LIMIT ? OFFSET ?")
+            params = [match] + params
+        else:
+            likes = " OR ".join("(p.title LIKE ? OR p.abstract LIKE ?)" for _ in words)
+            where = " AND ".join([f"({likes})"] + filters)
+            sql = f"SELECT {columns} FROM papers p WHERE {where} ORDER BY p.citations DESC LIMIT ? OFFSET ?"
+            params = [f"%{word}%" for word in words for _ in range(2)] + params
+        with self.lock:
+            rows = self.conn.execute(sql, params + [limit, offset]).fetchall()
+        return [Paper.from_api(self._record(row)) for row in rows]
+
+    def iter_training_pairs(self, batch_size: int = 1000, min_year: Optional[int] = None,
+                            max_year: Optional[int] = None) -> Iterator[Tuple[str, int]]:
+        """
+        Stream (make_model_input text, citation count) pairs for every paper with an abstract and a known
+        citation count, reading batch_size rows at a time from a separate connection
+        """
+        from PaperAgent.agents.paper_batch import PaperBatch
+        filters, params = ["abstract != ''", "citations >= 0"], []
+        if min_year is not None:
+            filters.append("year >= ?")
+            params.append(min_year)
+        if max_year is not None:
+            filters.append("year <= ?")
+            params.append(max_year)
+        conn = sqlite3.connect(self.path)
+        try:
+            cursor = conn.execute(f"SELECT {_COLUMNS} FROM papers WHERE {' AND '.join(filters)} ORDER BY id", params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                batch = PaperBatch.from_api([self._record(row) for row in rows])
+                yield from zip(batch.make_model_inputs(), batch.citations.tolist())
+        finally:
+            conn.close()
+
+    def export_training_pairs(self, path: str, **filters) -> int:
+        """
+        Write the training pairs to a JSON-lines file of {"text": ..., "citations": ...}
+        :return: the number of pairs written
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        count = 0
+        with open(path, "w") as f:
+            for text, citations in self.iter_training_pairs(**filters):
+                f.write(json.dumps({"text": text, "citations": citations}) + "\n")
+                count += 1
+        return count
+
+
+# RUN: python -m PaperAgent.agents.corpus harvest "graph neural networks" --pages 20
+#      python -m PaperAgent.agents.corpus export training.jsonl --min-year 2018
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and use the local paper corpus")
+    parser.add_argument("--path", default=CORPUS_PATH, help="the corpus database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    harvest = commands.add_parser("harvest", help="fetch pages of a query into the corpus")
+    harvest.add_argument("query")
+    harvest.add_argument("--pages", type=int, default=10)
+    harvest.add_argument("--limit", type=int, default=100)
+    harvest.add_argument("--year", default="-2025")
+    search = commands.add_parser("search", help="full-text search of the corpus")
+    search.add_argument("text")
+    search.add_argument("--limit", type=int, default=10)
+    export = commands.add_parser("export", help="write make_model_input/citation training pairs as JSON lines")
+    export.add_argument("output")
+    export.add_argument("--min-year", type=int)
+    export.add_argument("--max-year", type=int)
+    args = parser.parse_args()
+
+    corpus = CorpusStore(args.path)
+    if args.command == "harvest":
+        for page in range(args.pages):
+            records = corpus.fetch_records(args.query, page, args.limit, args.year)
+            print(f"Page {page}: {len(records)} papers, {corpus.count()} in the corpus")
+            if len(records) < args.limit:
+                break
+    elif args.command == "search":
+        for paper in corpus.search(args.text, limit=args.limit):
+            print(paper.describe())
+    else:
+        count = corpus.export_training_pairs(args.output, min_year=args.min_year, max_year=args.max_year)
+        print(f"Wrote {count} training pairs to {args.output}")
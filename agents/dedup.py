@@ -0,0 +1,151 @@
+import itertools
+import re
+import zlib
+from typing import Sequence
+import numpy as np
+
+from PaperAgent.agents.agent import Agent
+
+_TOKEN = re.compile(rb"[a-z0-9]+")
+_FNV = np.uint32(0x01000193)
+
+
+class NearDuplicateFilter(Agent):
+    """
+    Collapse near-duplicate papers (arXiv versions, preprint and venue copies) into one,
+    by MinHash signatures of their normalized title and abstract and LSH banding,
+    so only pairs that share a band are ever compared
+    """
+
+    name = "Dedup"
+    color = Agent.CYAN
+
+    def __init__(self, threshold: float = 0.7, num_perm: int = 128, bands: int = 32, shingle: int = 3,
+                 chunk: int = 1024, seed: int = 42):
+        """
+        :param threshold: estimated Jaccard similarity of word shingles above which two papers are the same work
+        :param num_perm: signature length; must be divisible by bands
+        :param bands: LSH bands; more bands find more candidate pairs
+        :param shingle: words per shingle
+        :param chunk: how many papers are hashed at once, to bound memory
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle = shingle
+        self.chunk = chunk
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(0, 2 ** 32, num_perm, dtype=np.uint32) | np.uint32(1)
+        self.b = rng.integers(0, 2 ** 32, num_perm, dtype=np.uint32)
+
+    def _shingles(self, texts: Sequence[str]):
+        """
+        32-bit hashes of the word n-grams of every normalized text, concatenated
+        :return: the hashes, and the offset at which each text's run of hashes starts
+        """
+        tokens = [_TOKEN.findall(text.lower().encode("utf-8")) for text in texts]
+        # Pad short texts so every text has at least one shingle
+        tokens = [t + [b""] * (self.shingle - len(t)) if len(t) < self.shingle else t for t in tokens]
+        lengths = np.array([len(t) for t in tokens])
+        hashes = np.fromiter(map(zlib.crc32, itertools.chain.from_iterable(tokens)), dtype=np.uint32,
+                             count=int(lengths.sum()))
+        counts = lengths - self.shingle + 1
+        offsets = np.r_[0, np.cumsum(counts)[:-1]]
+        token_offsets = np.r_[0, np.cumsum(lengths)[:-1]]
+        starts = np.repeat(token_offsets - offsets, counts) + np.arange(counts.sum())
+        combined = hashes[starts]
+        for offset in range(1, self.shingle):
+            combined = combined * _FNV + hashes[starts + offset]
+        return combined, offsets
+
+    def signatures(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        One MinHash signature per text, as a (len(texts), num_perm) matrix
+        """
+        signatures = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        for start in range(0, len(texts), self.chunk):
+            shingles, offsets = self._shingles(texts[start:start + self.chunk])
+            # Each row is one permutation, x -> a * x + b modulo 2^32 with a odd
+            hashed = np.empty((self.num_perm, len(shingles)), dtype=np.uint32)
+            np.multiply(self.a[:, None], shingles[None, :], out=hashed)
+            hashed += self.b[:, None]
+            signatures[start:start + len(offsets)] = np.minimum.reduceat(hashed, offsets, axis=1).T
+        return signatures
+
+    def clusters(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Label each text with the index of the first text in its group of near-duplicates
+        """
+        n = len(texts)
+        parent = np.arange(n)
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        if n < 2:
+            return parent
+        signatures = self.signatures(texts)
+        rows = self.num_perm // self.bands
+        for band in range(self.bands):
+            block = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+            keys = block.view(np.dtype((np.void, block.dtype.itemsize * rows))).ravel()
+            order = np.argsort(keys, kind="stable")
+            sorted_keys = keys[order]
+            starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+            ends = np.r_[starts[1:], n]
+            shared = ends - starts > 1
+            for start, end in zip(starts[shared], ends[shared]):
+                members = order[start:end]
+                bucket = signatures[members]
+                # Every pair in the bucket, one row at a time: two copies can share a bucket with an unrelated paper
+                for i in range(len(members) - 1):
+                    similarity = (bucket[i + 1:] == bucket[i]).mean(axis=1)
+                    for member in members[i + 1:][similarity >= self.threshold]:
+                        root_head, root_member = find(members[i]), find(member)
+                        if root_head != root_member:
+                            parent[max(root_head, root_member)] = min(root_head, root_member)
+        return np.array([find(i) for i in range(n)])
+
+    @staticmethod
+    def text(title: str, abstract: str) -> str:
+        return f"{title or ''} {abstract or ''}"
+
+    def collapse(self, papers):
+        """
+        Merge each group of near-duplicates into its most cited copy, with `version` noting how many were merged
+        :param papers: a list of papers, or a PaperBatch
+        :return: the same kind of collection, in order of each work's first appearance
+        """
+        if len(papers) < 2:
+            return papers
+        if hasattr(papers, "columns"):
+            texts = [self.text(title, abstract) for title, abstract in zip(papers.title, papers.abstract)]
+            citations = papers.citations
+        else:
+            texts = [self.text(paper.title, paper.abstract) for paper in papers]
+            citations = np.array([paper.citations for paper in papers])
+        labels = self.clusters(texts)
+        # Most cited first, then earliest; the first row of each label is its canonical copy
+        order = np.lexsort((np.arange(len(labels)), -citations, labels))
+        first = np.r_[True, labels[order][1:] != labels[order][:-1]]
+        canonical = order[first]
+        sizes = np.bincount(labels, minlength=len(labels))[labels[canonical]]
+        # Each kept paper takes the place of the first copy of its work
+        keep = np.argsort(labels[canonical])
+        canonical, sizes = canonical[keep], sizes[keep]
+        if len(canonical) < len(labels):
+            self.log("Dedup collapsed %d papers into %d", len(labels), len(canonical))
+        versions = [f"({size} versions)" if size > 1 else None for size in sizes]
+        if hasattr(papers, "columns"):
+            batch = papers.take(canonical)
+            batch.columns["version"] = np.array(versions, dtype=object)
+            return batch
+        return [
+            papers[row].model_copy(update={"version": version}) if version else papers[row]
+            for row, version in zip(canonical.tolist(), versions)
+        ]
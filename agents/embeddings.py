@@ -0,0 +1,208 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+
+from PaperAgent.agents import metrics
+
+MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+DIMENSIONS = 384
+
+
+class EmbeddingStore:
+    """
+    An append-only on-disk store of embeddings keyed by content hash
+    Vectors live in a memory-mapped matrix (float32, or int8 with a per-row scale),
+    and the keys in a text file whose line number is the row in the matrix
+    """
+
+    GROWTH = 4096
+
+    def __init__(self, directory: str, dimensions: int = DIMENSIONS, quantize: bool = False):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.quantize = quantize
+        self.dtype = np.int8 if quantize else np.float32
+        os.makedirs(directory, exist_ok=True)
+        suffix = "i8" if quantize else "f32"
+        self.keys_path = os.path.join(directory, f"keys.{suffix}.txt")
+        self.vectors_path = os.path.join(directory, f"vectors.{suffix}")
+        self.scales_path = os.path.join(directory, "scales.f32")
+        self.rows: Dict[str, int] = {}
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path) as f:
+                for row, line in enumerate(f):
+                    self.rows[line.strip()] = row
+        self.vectors = None
+        self.scales = None
+        self._open(max(self.GROWTH, len(self.rows)))
+
+    def _map(self, path: str, dtype, shape) -> np.memmap:
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _open(self, capacity: int) -> None:
+        if self.vectors is not None:
+            self.vectors.flush()
+        self.capacity = capacity
+        self.vectors = self._map(self.vectors_path, self.dtype, (capacity, self.dimensions))
+        if self.quantize:
+            self.scales = self._map(self.scales_path, np.float32, (capacity,))
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        vector = np.array(self.vectors[row], dtype=np.float32)
+        if self.quantize:
+            vector *= self.scales[row]
+        return vector
+
+    def put_many(self, keys: List[str], vectors: np.ndarray) -> None:
+        new = [(key, vector) for key, vector in zip(keys, vectors) if key not in self.rows]
+        if not new:
+            return
+        needed = len(self.rows) + len(new)
+        if needed > self.capacity:
+            self._open(max(needed, self.capacity + self.GROWTH))
+        with open(self.keys_path, "a") as f:
+            for key, vector in new:
+                row = len(self.rows)
+                if self.quantize:
+                    scale = float(np.abs(vector).max()) / 127 or 1.0
+                    self.vectors[row] = np.round(vector / scale).astype(np.int8)
+                    self.scales[row] = scale
+                else:
+                    self.vectors[row] = vector
+                self.rows[key] = row
+                f.write(key + "\n")
+        self.vectors.flush()
+        if self.quantize:
+            self.scales.flush()
+
+
+class EmbeddingService:
+    """
+    A process-wide MiniLM encoder shared by every agent
+    The model is loaded on first use; embeddings are kept by content hash in an in-memory LRU,
+    optionally backed by an EmbeddingStore so they survive restarts
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, capacity: int = 10_000, store: Optional[EmbeddingStore] = None,
+                 encoder=None):
+        """
+        :param encoder: use this object's SentenceTransformer-style encode() instead of loading model_name
+        """
+        self.model_name = model_name
+        self.capacity = capacity
+        self.store = store
+        self.memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._model = encoder
+        self.lock = threading.RLock()
+
+    @property
+    def model(self):
+        with self.lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.model_name)
+            return self._model
+
+    def key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\n{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def encode_many(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        """
+        Embed a list of texts, running the transformer only on texts that have not been seen before
+        :return: a float32 matrix with one row per text, in the same order
+        """
+        keys = [self.key(text) for text in texts]
+        result = np.zeros((len(texts), DIMENSIONS), dtype=np.float32)
+        missing: Dict[str, List[int]] = {}
+        with self.lock:
+            for i, key in enumerate(keys):
+                vector = self.memory.get(key)
+                if vector is None and self.store is not None:
+                    vector = self.store.get(key)
+                if vector is None:
+                    missing.setdefault(key, []).append(i)
+                    continue
+                self._remember(key, vector)
+                result[i] = vector
+            misses = sum(len(rows) for rows in missing.values())
+            self.hits += len(texts) - misses
+            self.misses += misses
+        metrics.increment("cache_hits_total", len(texts) - misses, cache="embeddings")
+        metrics.increment("cache_misses_total", misses, cache="embeddings")
+        if missing:
+            new_keys = list(missing)
+            new_texts = [texts[missing[key][0]] for key in new_keys]
+            vectors = np.asarray(self.model.encode(new_texts, batch_size=batch_size), dtype=np.float32)
+            with self.lock:
+                for key, vector in zip(new_keys, vectors):
+                    self._remember(key, vector)
+                    result[missing[key]] = vector
+                if self.store is not None:
+                    self.store.put_many(new_keys, vectors)
+        return result
+
+    def encode(self, texts) -> np.ndarray:
+        """
+        Drop-in replacement for SentenceTransformer.encode on a string or a list of strings
+        """
+        if isinstance(texts, str):
+            return self.encode_many([texts])[0]
+        return self.encode_many(list(texts))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+_service: Optional[EmbeddingService] = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """
+    The shared EmbeddingService; set EMBEDDING_CACHE_DIR to persist embeddings on disk,
+    and EMBEDDING_CACHE_INT8=1 to store them quantized
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            directory = os.getenv("EMBEDDING_CACHE_DIR")
+            store = None
+            if directory:
+                store = EmbeddingStore(directory, quantize=os.getenv("EMBEDDING_CACHE_INT8") == "1")
+            _service = EmbeddingService(store=store)
+    return _service
+
+
+def set_embedding_service(service: EmbeddingService) -> None:
+    """
+    Replace the shared EmbeddingService, e.g. with one over a different model or encoder
+    Agents created afterwards pick it up
+    """
+    global _service
+    with _service_lock:
+        _service = service
@@ -1,48 +1,257 @@
-import pandas as pd
-from sklearn.linear_model import LinearRegression
-import joblib
-
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Dict, List, Optional, Tuple
 from PaperAgent.agents.agent import Agent
-from PaperAgent.agents.specialist_agent import SpecialistAgent
-from PaperAgent.agents.frontier_agent import FrontierAgent
-from PaperAgent.agents.random_forest_agent import RandomForestAgent
+from PaperAgent.agents.metrics import timed
 
 class EvaluateAgent(Agent):
 
     name = "Ensemble Agent"
     color = Agent.YELLOW
-    
-    def __init__(self, collection):
+
+    MODELS = ("Specialist", "Frontier", "RandomForest")
+
+    # Seconds each model has to respond, counted from the start of the evaluation
+    DEADLINES = {"Specialist": 30.0, "Frontier": 20.0, "RandomForest": 5.0}
+    BATCH_DEADLINES = {"Specialist": 120.0, "Frontier": 90.0, "RandomForest": 30.0}
+
+    ENSEMBLE_PATH = "ensemble_model.pkl"
+
+    def __init__(self, collection, deadlines: Optional[Dict[str, float]] = None, specialist=None, frontier=None,
+                 random_forest=None):
         """
-        Create an instance of Ensemble, by creating each of the models
-        And loading the weights of the Ensemble
+        Create an instance of Ensemble
+        Each of the models, and the weights of the Ensemble, are only loaded the first time they are used
+        :param deadlines: override the per-model deadlines in seconds
+        :param specialist: use this agent instead of creating a SpecialistAgent; likewise frontier and random_forest
         """
         self.log("Initializing Ensemble Agent")
-        self.specialist = SpecialistAgent()
-        self.frontier = FrontierAgent(collection)
-        # self.random_forest = RandomForestAgent() ###########################################
-        # self.model = joblib.load('ensemble_model.pkl') ##############################################
+        self.collection = collection
+        self.deadlines = {**self.DEADLINES, **(deadlines or {})}
+        self._specialist = specialist
+        self._frontier = frontier
+        self._random_forest = random_forest
+        self.ensembles = {}
+        self.startup_times = {}
+        self.lock = threading.RLock()
+        self.locks = {component: threading.Lock() for component in ("specialist", "frontier", "random_forest")}
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(self.MODELS), thread_name_prefix="ensemble")
+        # Calls that outlived their deadline and still hold an executor worker, per model
+        self.abandoned = {model: 0 for model in self.MODELS}
+        self.abandoned_lock = threading.Lock()
         self.log("Ensemble Agent is ready")
 
+    def _timed(self, component: str, factory):
+        start = time.perf_counter()
+        result = factory()
+        self.startup_times[component] = time.perf_counter() - start
+        self.log(f"Ensemble Agent loaded {component} in {self.startup_times[component]:.2f}s")
+        return result
+
+    @property
+    def specialist(self):
+        with self.locks["specialist"]:
+            if self._specialist is None:
+                from PaperAgent.agents.specialist_agent import SpecialistAgent
+                self._specialist = self._timed("specialist", SpecialistAgent)
+            return self._specialist
+
+    @property
+    def frontier(self):
+        with self.locks["frontier"]:
+            if self._frontier is None:
+                from PaperAgent.agents.frontier_agent import FrontierAgent
+                self._frontier = self._timed("frontier", lambda: FrontierAgent(self.collection))
+            return self._frontier
+
+    @property
+    def random_forest(self):
+        with self.locks["random_forest"]:
+            if self._random_forest is None:
+                from PaperAgent.agents.random_forest_agent import RandomForestAgent
+                self._random_forest = self._timed("random_forest", RandomForestAgent)
+            return self._random_forest
+
+    @classmethod
+    def ensemble_path(cls, models: Tuple[str, ...]) -> str:
+        """
+        The full ensemble lives in ensemble_model.pkl, and the fallback trained on a subset of
+        the models in e.g. ensemble_model_frontier_randomforest.pkl
+        """
+        if tuple(models) == cls.MODELS:
+            return cls.ENSEMBLE_PATH
+        root, ext = os.path.splitext(cls.ENSEMBLE_PATH)
+        return f"{root}_{'_'.join(model.lower() for model in models)}{ext}"
+
+    def ensemble_for(self, models: Tuple[str, ...]):
+        """
+        The linear regression over these models' predictions, or None if it was never trained
+        """
+        with self.lock:
+            if models not in self.ensembles:
+                path = self.ensemble_path(models)
+                if os.path.exists(path):
+                    import joblib
+                    self.ensembles[models] = self._timed(os.path.basename(path), lambda: joblib.load(path))
+                else:
+                    self.ensembles[models] = None
+            return self.ensembles[models]
+
+    @property
+    def model(self):
+        return self.ensemble_for(self.MODELS)
+
+    def warm_up(self) -> dict:
+        """
+        Load every model now rather than on the first evaluation
+        :return: seconds spent loading each component
+        """
+        for component in ("specialist", "frontier", "random_forest"):
+            getattr(self, component)
+        for models in self.model_subsets():
+            self.ensemble_for(models)
+        return dict(self.startup_times)
+
+    @classmethod
+    def model_subsets(cls) -> List[Tuple[str, ...]]:
+        return [subset for size in range(len(cls.MODELS), 0, -1) for subset in itertools.combinations(cls.MODELS, size)]
+
+    @staticmethod
+    def features(predictions: Dict[str, List[float]]):
+        """
+        The ensemble's input: one column per model that responded, plus their row-wise Min and Max
+        """
+        import pandas as pd
+        X = pd.DataFrame(predictions)
+        columns = list(predictions)
+        X['Min'] = X[columns].min(axis=1)
+        X['Max'] = X[columns].max(axis=1)
+        return X
+
+    def train(self, predictions: Dict[str, List[float]], y: List[float]) -> None:
+        """
+        Fit and save the full ensemble and a fallback for every subset of the models,
+        so an evaluation can still be combined when some of the models don't respond
+        :param predictions: each model's predictions on the training set, keyed by model name
+        :param y: the true values
+        """
+        import joblib
+        from sklearn.linear_model import LinearRegression
+        with self.lock:
+            for models in self.model_subsets():
+                X = self.features({model: predictions[model] for model in models})
+                regression = LinearRegression().fit(X, y)
+                joblib.dump(regression, self.ensemble_path(models))
+                self.ensembles[models] = regression
+                self.log(f"Ensemble Agent trained the ensemble over {', '.join(models)}")
+
+    def _agent(self, model: str):
+        if model == "Specialist":
+            return self.specialist
+        if model == "Frontier":
+            return self.frontier
+        return self.random_forest
+
+    def _call(self, model: str, description: str) -> float:
+        return self._agent(model).price(description)
+
+    def _call_many(self, model: str, descriptions: List[str]) -> List[float]:
+        return self._agent(model).price_many(descriptions)
+
+    def gather(self, description: str) -> Dict[str, float]:
+        """
+        Ask each of the models concurrently, and keep the answers that arrive before their deadline
+        """
+        return self._gather(self._call, description, self.deadlines)
+
+    def gather_many(self, descriptions: List[str]) -> Dict[str, List[float]]:
+        """
+        Ask each of the models for all the descriptions in one batch, concurrently across models
+        """
+        return self._gather(self._call_many, descriptions, self.BATCH_DEADLINES)
+
+    def _release(self, model: str, future) -> None:
+        with self.abandoned_lock:
+            self.abandoned[model] -= 1
+
+    def _gather(self, call, argument, deadlines: Dict[str, float]) -> dict:
+        """
+        A model whose abandoned call is still running is skipped until that call returns,
+        so a hung backend cannot take over the executor and starve the healthy models
+        """
+        start = time.monotonic()
+        with self.abandoned_lock:
+            hung = [model for model in self.MODELS if self.abandoned[model]]
+        for model in hung:
+            self.log("Ensemble Agent skipped %s - its previous call is still running", model)
+        futures = {model: self.executor.submit(call, model, argument) for model in self.MODELS if model not in hung}
+        predictions = {}
+        for model, future in futures.items():
+            remaining = deadlines[model] - (time.monotonic() - start)
+            try:
+                predictions[model] = future.result(timeout=max(0.0, remaining))
+            except TimeoutError:
+                if not future.cancel():
+                    # Already running: it keeps its worker until it returns
+                    with self.abandoned_lock:
+                        self.abandoned[model] += 1
+                    future.add_done_callback(lambda done, model=model: self._release(model, done))
+                self.log("Ensemble Agent gave up on %s after %.0fs", model, deadlines[model])
+            except Exception as e:
+                self.log("Ensemble Agent got an error from %s: %s", model, e)
+        return predictions
+
+    def combine(self, predictions: Dict[str, float]) -> float:
+        """
+        Weight the predictions with the ensemble trained on exactly the models that responded,
+        falling back to their mean if no such ensemble was trained
+        """
+        return self.combine_many({model: [value] for model, value in predictions.items()})[0]
+
+    def combine_many(self, predictions: Dict[str, List[float]]) -> List[float]:
+        """
+        Vectorized combine: one row per item, a single predict for the whole batch
+        """
+        if not predictions:
+            raise RuntimeError("None of the ensemble models responded in time")
+        models = tuple(model for model in self.MODELS if model in predictions)
+        X = self.features({model: list(predictions[model]) for model in models})
+        ensemble = self.ensemble_for(models)
+        if ensemble is None:
+            self.log("Ensemble Agent has no ensemble for %s - averaging them", ", ".join(models))
+            y = X[list(models)].mean(axis=1).to_numpy()
+        else:
+            y = ensemble.predict(X)
+        return [max(0, value) for value in y]
+
+    @timed
     def evaluate(self, description: str) -> float:
         """
         Run this ensemble model
-        Ask each of the models to price the product
+        Ask each of the models to price the product, all at the same time
         Then use the Linear Regression model to return the weighted price
         :param description: the description of a product
         :return: an estimate of its price
         """
         self.log("Running Ensemble Agent - collaborating with specialist, frontier and random forest agents")
-        specialist = self.specialist.price(description)
-        frontier = self.frontier.price(description)
-        random_forest = self.random_forest.price(description)
-        X = pd.DataFrame({
-            'Specialist': [specialist],
-            'Frontier': [frontier],
-            'RandomForest': [random_forest],
-            'Min': [min(specialist, frontier, random_forest)],
-            'Max': [max(specialist, frontier, random_forest)],
-        })
-        y = max(0, self.model.predict(X)[0])
-        self.log(f"Ensemble Agent complete - returning ${y:.2f}")
-        return y
\ No newline at end of file
+        y = self.combine(self.gather(description))
+        self.log("Ensemble Agent complete - returning $%.2f", y)
+        return y
+
+    @timed
+    def evaluate_many(self, descriptions: List[str]) -> List[float]:
+        """
+        Run this ensemble model over a batch: each model prices the whole batch at once,
+        and the Linear Regression weights every row with a single predict
+        :param descriptions: the descriptions to estimate
+        :return: the estimates, in the same order
+        """
+        if not descriptions:
+            return []
+        self.log("Running Ensemble Agent on a batch of %d", len(descriptions))
+        y = self.combine_many(self.gather_many(descriptions))
+        self.log("Ensemble Agent complete - returning %d estimates", len(y))
+        return y
@@ -4,15 +4,14 @@ import os
 import re
 import math
 import json
-from typing import List, Dict
-from openai import OpenAI
-from sentence_transformers import SentenceTransformer
-from datasets import load_dataset
-import chromadb
+from typing import List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
 
-from PaperAgent.items import Item
-from PaperAgent.testing import Tester
 from PaperAgent.agents.agent import Agent
+from PaperAgent.agents.metrics import timed
+from PaperAgent.agents.embeddings import get_embedding_service
+from PaperAgent.agents.llm_cache import complete
+from PaperAgent.agents.resilience import endpoint
 
 
 class FrontierAgent(Agent):
@@ -22,23 +21,31 @@ class FrontierAgent(Agent):
 
     MODEL = "gpt-4o-mini"
     
-    def __init__(self, collection):
+    def __init__(self, collection, client=None):
         """
         Set up this instance by connecting to OpenAI or DeepSeek, to the Chroma Datastore,
         And setting up the vector encoding model
+        :param collection: a Chroma collection, or an in-process VectorIndex with the same query interface
+        :param client: use this OpenAI-compatible client instead of connecting to OpenAI or DeepSeek
         """
         self.log("Initializing Frontier Agent")
         deepseek_api_key = os.getenv("DEEPSEEK_API_KEY")
-        if deepseek_api_key:
+        if client is not None:
+            self.client = client
+            self.log("Frontier Agent is set up with the given client")
+        elif deepseek_api_key:
+            from openai import OpenAI
             self.client = OpenAI(api_key=deepseek_api_key, base_url="https://api.deepseek.com")
             self.MODEL = "deepseek-chat"
             self.log("Frontier Agent is set up with DeepSeek")
         else:
+            from openai import OpenAI
             self.client = OpenAI()
             self.MODEL = "gpt-4o-mini"
             self.log("Frontier Agent is setting up with OpenAI")
         self.collection = collection
-        self.model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+        self.model = get_embedding_service()
+        self.llm = endpoint("frontier.llm", deadline=20.0, retries=2, timeout_kwarg="timeout")
         self.log("Frontier Agent is ready")
 
     def make_context(self, similars: List[str], prices: List[float]) -> str:
@@ -72,6 +79,7 @@ class FrontierAgent(Agent):
             {"role": "assistant", "content": "Price is $"}
         ]
 
+    @timed
     def find_similars(self, description: str):
         """
         Return a list of items similar to the given one by looking in the Chroma datastore
@@ -84,6 +92,20 @@ class FrontierAgent(Agent):
         self.log("Frontier Agent has found similar products")
         return documents, prices
 
+    @timed
+    def find_similars_many(self, descriptions: List[str]) -> List[Tuple[List[str], List[float]]]:
+        """
+        Look up the similar items of every description with one batched encode and one multi-query to Chroma
+        :return: a (documents, prices) pair per description
+        """
+        self.log("Frontier Agent is performing a batched RAG search for %d descriptions", len(descriptions))
+        vectors = self.model.encode_many(descriptions)
+        results = self.collection.query(query_embeddings=vectors.astype(float).tolist(), n_results=5)
+        return [
+            (list(documents), [m['price'] for m in metadatas])
+            for documents, metadatas in zip(results['documents'], results['metadatas'])
+        ]
+
     def get_price(self, s) -> float:
         """
         A utility that plucks a floating point number out of a string
@@ -100,15 +122,36 @@ class FrontierAgent(Agent):
         :return: an estimate of the price
         """
         documents, prices = self.find_similars(description)
-        self.log(f"Frontier Agent is about to call {self.MODEL} with context including 5 similar products")
-        response = self.client.chat.completions.create(
+        return self.complete(description, documents, prices)
+
+    @timed
+    def complete(self, description: str, documents: List[str], prices: List[float]) -> float:
+        """
+        Ask the LLM for an estimate, given the similar items already looked up
+        """
+        self.log("Frontier Agent is about to call %s with context including 5 similar products", self.MODEL)
+        reply = complete(
+            self.client,
+            via=self.llm,
             model=self.MODEL, 
             messages=self.messages_for(description, documents, prices),
             seed=42,
             max_tokens=5
         )
-        reply = response.choices[0].message.content
         result = self.get_price(reply)
-        self.log(f"Frontier Agent completed - predicting ${result:.2f}")
+        self.log("Frontier Agent completed - predicting $%.2f", result)
         return result
-        
\ No newline at end of file
+
+    @timed
+    def price_many(self, descriptions: List[str], max_workers: int = 8) -> List[float]:
+        """
+        Estimate many descriptions: one batched RAG search, then at most max_workers LLM calls in flight
+        :return: the estimates, in the same order as the descriptions
+        """
+        if not descriptions:
+            return []
+        similars = self.find_similars_many(descriptions)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(descriptions)))) as executor:
+            return list(executor.map(
+                lambda args: self.complete(args[0], *args[1]), zip(descriptions, similars)
+            ))
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+
+from PaperAgent.agents import metrics
+from PaperAgent.agents.response_cache import ResponseCache
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "cache/llm.sqlite")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+
+
+class LLMCache:
+    """
+    Cache chat completions keyed by (model, normalized messages, params)
+    Sits in front of any OpenAI-compatible client, so it works for OpenAI and DeepSeek alike
+    """
+
+    def __init__(self, cache: ResponseCache):
+        self.cache = cache
+
+    @staticmethod
+    def key(model: str, messages: List[Dict[str, str]], **params) -> str:
+        normalized = [(m["role"], " ".join(str(m["content"]).split())) for m in messages]
+        payload = json.dumps([model, normalized, params], sort_keys=True, default=str)
+        return "chat:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def complete(self, client, model: str, messages: List[Dict[str, str]], via=None, **params) -> str:
+        """
+        Return the content of the completion for this request, calling the client only on a miss
+        :param via: an Endpoint to make the call through, for deadlines, hedging and circuit breaking
+        """
+        key = self.key(model, messages, **params)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        content = _create(client, model, messages, via, **params)
+        if content is not None:
+            self.cache.set(key, content)
+        return content
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+class SemanticCache:
+    """
+    Reuse an earlier answer when a new request is nearly identical to one already seen,
+    judged by cosine similarity of their MiniLM embeddings
+    The (request, answer) pairs are persisted in the response cache under `namespace`
+    """
+
+    def __init__(self, cache: ResponseCache, namespace: str = "semantic", threshold: float = 0.95,
+                 max_entries: int = 1000):
+        from PaperAgent.agents.embeddings import get_embedding_service
+        self.cache = cache
+        self.namespace = namespace
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.embeddings = get_embedding_service()
+        self.lock = threading.Lock()
+        self.entries = self.cache.get(self._key()) or []
+        self.matrix = None
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self) -> str:
+        return f"{self.namespace}:entries"
+
+    def _normalized(self, texts: List[str]) -> np.ndarray:
+        vectors = self.embeddings.encode_many(texts)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def get(self, request: str) -> Optional[str]:
+        with self.lock:
+            if not self.entries:
+                self.misses += 1
+                return None
+            if self.matrix is None:
+                self.matrix = self._normalized([entry[0] for entry in self.entries])
+            similarities = self.matrix @ self._normalized([request])[0]
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                self.hits += 1
+                metrics.increment("cache_hits_total", cache=self.namespace)
+                return self.entries[best][1]
+            self.misses += 1
+            metrics.increment("cache_misses_total", cache=self.namespace)
+            return None
+
+    def set(self, request: str, answer: str) -> None:
+        with self.lock:
+            self.entries.append([request, answer])
+            self.entries = self.entries[-self.max_entries:]
+            self.matrix = None
+            self.cache.set(self._key(), self.entries)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+_llm_cache: Optional[LLMCache] = None
+_llm_cache_configured = False
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """
+    The process-wide LLM cache, opened on first use; set LLM_CACHE_TTL=0 to disable
+    """
+    global _llm_cache, _llm_cache_configured
+    with _llm_cache_lock:
+        if not _llm_cache_configured:
+            if LLM_CACHE_TTL > 0:
+                _llm_cache = LLMCache(ResponseCache(LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES))
+            _llm_cache_configured = True
+    return _llm_cache
+
+
+def set_llm_cache(cache: Optional[LLMCache]) -> None:
+    """
+    Replace the LLM cache; None disables caching
+    """
+    global _llm_cache, _llm_cache_configured
+    with _llm_cache_lock:
+        _llm_cache = cache
+        _llm_cache_configured = True
+
+
+def _create(client, model: str, messages: List[Dict[str, str]], via=None, **params) -> str:
+    if via is not None:
+        response = via.call(client.chat.completions.create, model=model, messages=messages, **params)
+    else:
+        response = client.chat.completions.create(model=model, messages=messages, **params)
+    metrics.record_usage(response, model)
+    return response.choices[0].message.content
+
+
+def complete(client, model: str, messages: List[Dict[str, str]], via=None, **params) -> str:
+    """
+    A chat completion through the shared cache, or straight to the client when caching is disabled
+    :param via: an Endpoint to make the call through, for deadlines, hedging and circuit breaking
+    """
+    cache = get_llm_cache()
+    if cache is not None:
+        return cache.complete(client, model, messages, via=via, **params)
+    return _create(client, model, messages, via, **params)
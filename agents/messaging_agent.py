@@ -1,27 +1,195 @@
 import os
 # from twilio.rest import Client
+import atexit
 import http.client
+import logging
+import queue
+import threading
+import time
 import urllib
+import weakref
+from typing import Callable, List, Optional
 from PaperAgent.agents.agent import Agent
+from PaperAgent.agents.metrics import timed
 from PaperAgent.agents.papers import Paper
+from PaperAgent.agents.rate_limiter import TokenBucket
+from PaperAgent.agents.resilience import endpoint
 
 # Uncomment the Twilio lines if you wish to use Twilio
 
 DO_TEXT = False
 DO_PUSH = True
 
+PUSHOVER_MAX_LENGTH = 1024
+
+# Seconds the interpreter waits at exit for queued notifications before dropping them
+EXIT_FLUSH_TIMEOUT = float(os.getenv("NOTIFY_EXIT_TIMEOUT", "10"))
+
+
+class HTTPSConnectionPool:
+    """
+    A small pool of keep-alive HTTPS connections to one host, so each request
+    reuses an open TCP/TLS session instead of handshaking again
+    """
+
+    def __init__(self, host: str, size: int = 2, timeout: float = 10.0):
+        self.host = host
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def _connection(self):
+        """
+        :return: a connection, and whether it is a reused keep-alive one
+        """
+        try:
+            return self.idle.get_nowait(), True
+        except queue.Empty:
+            return http.client.HTTPSConnection(self.host, timeout=self.timeout), False
+
+    def _release(self, conn: http.client.HTTPSConnection) -> None:
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, method: str, path: str, body: str, headers: dict) -> int:
+        """
+        Send a request and return the response status
+        It is sent once more only when it cannot have reached the server: the send itself failed,
+        or a reused connection turned out to have been closed by the server before it replied at all.
+        Any other failure, e.g. a timeout waiting for the response, is raised, since the request may have been handled
+        """
+        for attempt in range(2):
+            conn, reused = self._connection()
+            try:
+                conn.request(method, path, body, headers)
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if attempt == 1:
+                    raise
+                continue
+            try:
+                response = conn.getresponse()
+                response.read()
+            except http.client.RemoteDisconnected:
+                conn.close()
+                if attempt == 1 or not reused:
+                    raise
+                continue
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            return response.status
+
+    def close(self) -> None:
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class NotificationDispatcher:
+    """
+    Deliver notifications from a background thread, paced by a token bucket,
+    so sending them never blocks the caller
+    """
+
+    def __init__(self, send: Callable[[str], None], rate: float = 1.0, burst: float = 5, maxsize: int = 1000):
+        self.send = send
+        self.limiter = TokenBucket(rate=rate, capacity=burst)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        # The thread only holds a weak reference, so a dispatcher nobody uses any more can be collected
+        self.thread = threading.Thread(target=NotificationDispatcher._loop, args=(weakref.ref(self), self.queue),
+                                       daemon=True, name="notifications")
+        self.thread.start()
+        weakref.finalize(self, self.queue.put, None)
+        _dispatchers.add(self)
+
+    def submit(self, text: str) -> bool:
+        """
+        Queue a notification; it is dropped if the queue is full
+        :return: whether it was queued
+        """
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    @staticmethod
+    def _loop(ref: weakref.ref, q: queue.Queue) -> None:
+        while True:
+            text = q.get()
+            dispatcher = ref()
+            try:
+                if text is None or dispatcher is None:
+                    return
+                dispatcher.limiter.acquire()
+                dispatcher.send(text)
+                dispatcher.sent += 1
+            except Exception as e:
+                dispatcher.failed += 1
+                logging.warning(f"Notification could not be delivered: {e}")
+            finally:
+                del dispatcher
+                q.task_done()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every queued notification has been handled, or until timeout seconds have passed
+        :return: whether the queue was drained
+        """
+        if timeout is None:
+            self.queue.join()
+            return True
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not self.queue.unfinished_tasks
+
+    def close(self) -> None:
+        _dispatchers.discard(self)
+        self.queue.put(None)
+        self.thread.join()
+
+
+_dispatchers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_at_exit() -> None:
+    """
+    The dispatcher threads are daemons: give what is still queued a bounded time to go out before the interpreter exits
+    """
+    deadline = time.monotonic() + EXIT_FLUSH_TIMEOUT
+    for dispatcher in list(_dispatchers):
+        if not dispatcher.flush(timeout=max(0.0, deadline - time.monotonic())):
+            logging.warning(f"Dropped {dispatcher.queue.unfinished_tasks} notifications that were still queued at exit")
+
 class MessagingAgent(Agent):
 
     name = "Messaging Agent"
     color = Agent.WHITE
 
-    def __init__(self):
+    def __init__(self, background: bool = True, rate: float = 1.0, pool=None):
         """
         Set up this object to either do push notifications via Pushover,
         or SMS via Twilio,
         whichever is specified in the constants
+        :param background: queue notifications and send them from a background thread
+        :param rate: the most notifications sent per second
+        :param pool: send pushes through this object's request() instead of a connection pool to Pushover
         """
-        self.log(f"Messaging Agent is initializing")
+        self.log("Messaging Agent is initializing")
         if DO_TEXT:
             account_sid = os.getenv('TWILIO_ACCOUNT_SID', 'your-sid-if-not-using-env')
             auth_token = os.getenv('TWILIO_AUTH_TOKEN', 'your-auth-if-not-using-env')
@@ -32,7 +200,11 @@ class MessagingAgent(Agent):
         if DO_PUSH:
             self.pushover_user = os.getenv('PUSHOVER_USER', 'your-pushover-user-if-not-using-env')
             self.pushover_token = os.getenv('PUSHOVER_TOKEN', 'your-pushover-user-if-not-using-env')
+            # Pushes are not idempotent, so they are never retried or hedged; the pool resends only unsent requests
+            self.pushover = endpoint("pushover", deadline=10.0, retries=0, hedge=False)
+            self.pool = pool or HTTPSConnectionPool("api.pushover.net:443")
             self.log("Messaging Agent has initialized Pushover")
+        self.dispatcher = NotificationDispatcher(self.deliver, rate=rate) if background else None
 
     def message(self, text):
         """
@@ -47,30 +219,71 @@ class MessagingAgent(Agent):
 
     def push(self, text):
         """
-        Send a Push Notification using the Pushover API
+        Send a Push Notification using the Pushover API, over a pooled keep-alive connection
         """
         self.log("Messaging Agent is sending a push notification")
-        conn = http.client.HTTPSConnection("api.pushover.net:443")
-        conn.request("POST", "/1/messages.json",
+        self.pushover.call(self._post, text, failure=lambda status: status >= 500)
+
+    @timed
+    def _post(self, text) -> int:
+        return self.pool.request("POST", "/1/messages.json",
           urllib.parse.urlencode({
             "token": self.pushover_token,
             "user": self.pushover_user,
-            "message": text,
+            "message": text[:PUSHOVER_MAX_LENGTH],
             "sound": "cashregister"
           }), { "Content-type": "application/x-www-form-urlencoded" })
-        conn.getresponse()
 
-    def alert(self, paper: Paper):
+    def deliver(self, text):
         """
-        Make an alert about the specified Paper
+        Send a notification now, on every configured channel
         """
-        text = f"Deal Alert! Price=${paper.deal.price:.2f}, "
-        text += f"Estimate=${paper.estimate:.2f}, "
-        text += f"Discount=${paper.discount:.2f} :"
-        text += paper.deal.product_description[:10]+'... '
-        text += paper.deal.url
         if DO_TEXT:
             self.message(text)
         if DO_PUSH:
             self.push(text)
-        self.log("Messaging Agent has completed")
\ No newline at end of file
+
+    def send(self, text):
+        """
+        Hand a notification to the background dispatcher, or deliver it now if there is none
+        """
+        if self.dispatcher is None:
+            self.deliver(text)
+        elif not self.dispatcher.submit(text):
+            self.log("Messaging Agent dropped a notification - the queue is full")
+
+    @staticmethod
+    def describe(paper: Paper) -> str:
+        return f"Citations={paper.citations}: {paper.title[:80]} {paper.url}"
+
+    def alert(self, paper: Paper):
+        """
+        Make an alert about the specified Paper
+        """
+        self.send("Paper Alert! " + self.describe(paper))
+        self.log("Messaging Agent has completed")
+
+    def alert_digest(self, papers: List[Paper]):
+        """
+        Make a single alert covering all of these papers, e.g. the top K of one plan
+        """
+        if not papers:
+            return
+        lines = [f"{i}. {self.describe(paper)}" for i, paper in enumerate(papers, 1)]
+        self.send(f"Paper Digest - {len(papers)} papers\n" + "\n".join(lines))
+        self.log("Messaging Agent has completed")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until all queued notifications have been sent, e.g. before a script moves on or exits
+        :return: whether they were all handled within the timeout
+        """
+        if self.dispatcher is not None:
+            return self.dispatcher.flush(timeout)
+        return True
+
+    def close(self):
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+        if DO_PUSH:
+            self.pool.close()
\ No newline at end of file
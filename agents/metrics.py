@@ -0,0 +1,271 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+# Set AGENT_METRICS=0 to turn every span and counter into a no-op
+METRICS_ENABLED = os.getenv("AGENT_METRICS", "1") != "0"
+# When set, every finished span is also appended to this JSON-lines file
+METRICS_PATH = os.getenv("AGENT_METRICS_PATH")
+
+# Latency histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram, cumulative on export as in the Prometheus text format
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        The upper bound of the bucket holding the p-th percentile
+        """
+        if not self.count:
+            return None
+        target = p / 100 * self.count
+        running = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            running += count
+            if running >= target:
+                return bound
+        return float("inf")
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+        }
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """
+    Times a block of code and records it in the registry's `<name>_seconds` histogram when it exits
+    """
+
+    __slots__ = ("registry", "name", "labels", "start")
+
+    def __init__(self, registry: "Registry", name: str, labels: Labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.finish(self, time.perf_counter() - self.start, ok=exc_type is None)
+        return False
+
+
+class Registry:
+    """
+    Process-wide counters and latency histograms, keyed by metric name and labels
+    """
+
+    def __init__(self, enabled: bool = METRICS_ENABLED, path: Optional[str] = METRICS_PATH):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.sink = None
+        if path:
+            self.open_sink(path)
+
+    def open_sink(self, path: str) -> None:
+        """
+        Append each finished span to a JSON-lines file
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.lock:
+            self.sink = open(path, "a", buffering=1)
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        if not self.enabled:
+            return
+        self._observe((name, _labels(labels)), seconds)
+
+    def _observe(self, key: Tuple[str, Labels], seconds: float) -> None:
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def span(self, name: str, **labels):
+        """
+        A context manager timing the enclosed block as `<name>_seconds`; errors are counted in `<name>_errors_total`
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, _labels(labels))
+
+    def finish(self, span: Span, seconds: float, ok: bool) -> None:
+        self._observe((span.name + "_seconds", span.labels), seconds)
+        if not ok:
+            key = (span.name + "_errors_total", span.labels)
+            with self.lock:
+                self.counters[key] = self.counters.get(key, 0) + 1
+        if self.sink is not None:
+            line = json.dumps({"time": time.time(), "span": span.name, **dict(span.labels),
+                               "seconds": round(seconds, 6), "ok": ok})
+            with self.lock:
+                self.sink.write(line + "\n")
+
+    def snapshot(self) -> dict:
+        """
+        Every counter, and a summary of every histogram, keyed by name and formatted labels
+        """
+        with self.lock:
+            return {
+                "counters": {name + _format_labels(labels): value for (name, labels), value in self.counters.items()},
+                "histograms": {name + _format_labels(labels): h.summary() for (name, labels), h in self.histograms.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                running = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    running += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {running}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_jsonl(self, path: str) -> None:
+        """
+        Append the current snapshot to a JSON-lines file
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as f:
+            f.write(json.dumps({"time": time.time(), **self.snapshot()}) + "\n")
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def serve(self, port: int = 9464, host: str = "127.0.0.1"):
+        """
+        Expose to_prometheus() at /metrics from a background HTTP server
+        Only on localhost by default; pass host="0.0.0.0" for a scraper on another machine
+        :return: the server, so it can be shut down
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+        return server
+
+
+registry = Registry()
+
+
+def span(name: str, **labels):
+    return registry.span(name, **labels)
+
+
+def increment(name: str, value: float = 1, **labels) -> None:
+    registry.increment(name, value, **labels)
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    registry.observe(name, seconds, **labels)
+
+
+def timed(fn):
+    """
+    Decorate an Agent method to record each call as a span named after the method, labelled with the agent
+    """
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if not registry.enabled:
+            return fn(self, *args, **kwargs)
+        with registry.span(fn.__name__, agent=getattr(self, "name", type(self).__name__)):
+            return fn(self, *args, **kwargs)
+    return wrapper
+
+
+def record_usage(response, model: str) -> None:
+    """
+    Count the prompt and completion tokens reported on a chat completion response
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None or not registry.enabled:
+        return
+    registry.increment("llm_prompt_tokens_total", getattr(usage, "prompt_tokens", 0) or 0, model=model)
+    registry.increment("llm_completion_tokens_total", getattr(usage, "completion_tokens", 0) or 0, model=model)
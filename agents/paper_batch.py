@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Union
+import numpy as np
+
+from PaperAgent.agents.papers import Paper, _extract_year
+
+
+class PaperRow:
+    """
+    A read-only view of one row of a PaperBatch, for code that only reads a few attributes
+    (e.g. SeenIndex.keys_for) and doesn't need a validated Paper
+    """
+
+    __slots__ = ("batch", "row")
+
+    def __init__(self, batch: "PaperBatch", row: int):
+        self.batch = batch
+        self.row = row
+
+    def __getattr__(self, name):
+        column = self.batch.columns.get(name)
+        if column is None:
+            raise AttributeError(name)
+        return column[self.row]
+
+
+class PaperBatch:
+    """
+    A columnar set of papers for bulk harvests: one NumPy array per field instead of one pydantic model per paper
+    Slicing returns views that share the parent's arrays, filters are vectorized boolean masks,
+    and Paper objects are only built for the rows that are finally needed
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+
+    def __getattr__(self, name):
+        columns = self.__dict__.get("columns")
+        if columns is None or name not in columns:
+            raise AttributeError(name)
+        return columns[name]
+
+    @classmethod
+    def empty(cls) -> "PaperBatch":
+        return cls.from_api([])
+
+    @classmethod
+    def from_api(cls, records: Sequence[Dict]) -> "PaperBatch":
+        """
+        Build a batch straight from Semantic Scholar search results, skipping per-paper validation
+        """
+        n = len(records)
+        title = np.empty(n, dtype=object)
+        abstract = np.empty(n, dtype=object)
+        url = np.empty(n, dtype=object)
+        paper_id = np.empty(n, dtype=object)
+        published = np.empty(n, dtype=object)
+        publication_date = np.empty(n, dtype=object)
+        year = np.zeros(n, dtype=np.int16)
+        citations = np.full(n, -1, dtype=np.int64)
+        for i, p in enumerate(records):
+            title[i] = p.get("title") or ""
+            abstract[i] = p.get("abstract") or ""
+            url[i] = p.get("url") or ""
+            paper_id[i] = p.get("paperId") or ""
+            publication_date[i] = p.get("publicationDate")
+            if p.get("year"):
+                year[i] = int(p["year"])
+                published[i] = str(p["year"])
+            if p.get("citationCount") is not None:
+                citations[i] = p["citationCount"]
+        return cls({
+            "title": title, "abstract": abstract, "url": url, "paper_id": paper_id, "published": published,
+            "publication_date": publication_date, "year": year, "citations": citations,
+            "score": np.full(n, np.nan, dtype=np.float32), "version": np.full(n, None, dtype=object),
+        })
+
+    @classmethod
+    def from_papers(cls, papers: Sequence[Paper]) -> "PaperBatch":
+        batch = cls.from_api([
+            {"title": p.title, "abstract": p.abstract, "url": p.url, "paperId": p.paper_id,
+             "publicationDate": p.publication_date, "citationCount": p.citations}
+            for p in papers
+        ])
+        for i, p in enumerate(papers):
+            batch.published[i] = p.published
+            batch.year[i] = int(_extract_year(p.published) or 0)
+            batch.version[i] = p.version
+            if p.score is not None:
+                batch.score[i] = p.score
+        return batch
+
+    @classmethod
+    def concat(cls, batches: Sequence["PaperBatch"]) -> "PaperBatch":
+        if not batches:
+            return cls.empty()
+        return cls({name: np.concatenate([b.columns[name] for b in batches]) for name in batches[0].columns})
+
+    @classmethod
+    def harvest(cls, query: str, pages: int = 10, start_offset: int = 0, limit: int = 100, year="2024-2024",
+                max_workers: int = 4, fetch=None) -> "PaperBatch":
+        """
+        Columnar counterpart of Paper.harvest: fetch pages concurrently and keep the raw records as columns
+        :param fetch: fetches one page of raw records, like Paper.fetch_papers_batch (the default)
+            or CorpusStore.fetch_records
+        """
+        fetch = fetch or Paper.fetch_papers_batch
+        page_numbers = range(start_offset, start_offset + pages)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, pages))) as executor:
+            pages = list(executor.map(lambda page: fetch(query, page, limit, year), page_numbers))
+        return cls.from_api([record for page in pages for record in page])
+
+    def __len__(self) -> int:
+        return len(self.columns["title"])
+
+    def take(self, index: Union[slice, np.ndarray, Sequence[int]]) -> "PaperBatch":
+        """
+        Select rows by slice (a zero-copy view), boolean mask or integer positions
+        """
+        if not isinstance(index, slice):
+            index = np.asarray(index)
+            if index.dtype != bool:
+                # An empty list would otherwise become float64, which numpy refuses as an index
+                index = index.astype(np.intp)
+        return PaperBatch({name: column[index] for name, column in self.columns.items()})
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.paper(int(index))
+        return self.take(index)
+
+    def __iter__(self) -> Iterator[Paper]:
+        for i in range(len(self)):
+            yield self.paper(i)
+
+    def rows(self) -> Iterator[PaperRow]:
+        for i in range(len(self)):
+            yield PaperRow(self, i)
+
+    def paper(self, i: int) -> Paper:
+        """
+        Materialize a single row as a Paper
+        """
+        score = self.score[i]
+        return Paper(
+            title=self.title[i],
+            abstract=self.abstract[i],
+            citations=int(self.citations[i]),
+            url=self.url[i],
+            published=self.published[i],
+            paper_id=self.paper_id[i],
+            publication_date=self.publication_date[i],
+            version=self.version[i],
+            score=None if np.isnan(score) else float(score),
+        )
+
+    def to_papers(self) -> List[Paper]:
+        return [self.paper(i) for i in range(len(self))]
+
+    def has_abstract(self) -> np.ndarray:
+        return np.fromiter((bool(a) for a in self.abstract), dtype=bool, count=len(self))
+
+    def with_abstract(self) -> "PaperBatch":
+        return self.take(self.has_abstract())
+
+    def in_years(self, start: Optional[int] = None, end: Optional[int] = None) -> "PaperBatch":
+        """
+        Keep the papers published between start and end inclusive; papers without a year are dropped
+        """
+        mask = self.year > 0
+        if start is not None:
+            mask &= self.year >= start
+        if end is not None:
+            mask &= self.year <= end
+        return self.take(mask)
+
+    def exclude_urls(self, urls) -> "PaperBatch":
+        urls = set(urls)
+        return self.take(np.fromiter((url not in urls for url in self.url), dtype=bool, count=len(self)))
+
+    def with_scores(self, scores: np.ndarray) -> "PaperBatch":
+        """
+        A batch sharing this one's columns, with the score column replaced
+        """
+        return PaperBatch({**self.columns, "score": np.asarray(scores, dtype=np.float32)})
+
+    def top_k(self, k: int, by: str = "score") -> "PaperBatch":
+        """
+        The k rows with the highest value in column `by`, best first; missing scores rank last
+        """
+        values = np.nan_to_num(self.columns[by].astype(np.float64), nan=-np.inf)
+        k = min(k, len(self))
+        if k <= 0:
+            return self.take(slice(0, 0))
+        top = np.argpartition(-values, k - 1)[:k]
+        return self.take(top[np.argsort(-values[top], kind="stable")])
+
+    def texts(self) -> List[str]:
+        """
+        The text to embed for each paper: its abstract, or the title when there is none
+        """
+        return [abstract or title for abstract, title in zip(self.abstract, self.title)]
+
+    def make_model_inputs(self) -> List[str]:
+        """
+        Paper.make_model_input for every row, without building the Papers
+        """
+        return [
+            f"Year: {year or ''}\nAbstract: {(abstract or '').strip()}\nNumber of citations: "
+            for year, abstract in zip(self.year.tolist(), self.abstract)
+        ]
@@ -1,11 +1,80 @@
 from typing import Dict, List, Optional
 from pydantic import BaseModel
-from bs4 import BeautifulSoup
 import re
-import feedparser
-from tqdm import tqdm
 import requests
+import threading
 import time
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PaperAgent.agents.rate_limiter import TokenBucket, backoff_delay, parse_retry_after
+from PaperAgent.agents.response_cache import ResponseCache
+from PaperAgent.agents.resilience import CircuitOpenError, endpoint
+
+BASE_URL = "https://api.semanticscholar.org/graph/v1/paper/search"
+FIELDS = "title,year,publicationDate,url,externalIds,citationCount,abstract"
+MAX_RETRIES = 4
+# The longest Retry-After honoured; a server asking for more is given up on rather than waited for
+MAX_RETRY_AFTER = float(os.getenv("SEMANTIC_SCHOLAR_MAX_RETRY_AFTER", "60"))
+# Requests per second shared by every thread in this process; raise it if you have an API key
+RATE_LIMITER = TokenBucket(rate=float(os.getenv("SEMANTIC_SCHOLAR_RPS", "1.0")),
+                           capacity=float(os.getenv("SEMANTIC_SCHOLAR_BURST", "3")))
+
+# Search responses are cached on disk; set PAPER_CACHE_TTL=0 to disable
+CACHE_PATH = os.getenv("PAPER_CACHE_PATH", "cache/semantic_scholar.sqlite")
+CACHE_TTL = float(os.getenv("PAPER_CACHE_TTL", str(6 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("PAPER_CACHE_MAX_ENTRIES", "5000"))
+
+# Retries and Retry-After are handled in fetch_papers_batch; the endpoint adds the deadline and breaker.
+# Hedging is off so a slow page never costs a second request against the rate limit
+SEMANTIC_SCHOLAR = endpoint("semantic_scholar", deadline=30.0, retries=0, hedge=False, timeout_kwarg="timeout")
+
+_local = threading.local()
+_cache: Optional[ResponseCache] = None
+_cache_configured = False
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    The process-wide search response cache, opened on first use
+    """
+    global _cache, _cache_configured
+    with _cache_lock:
+        if not _cache_configured:
+            if CACHE_TTL > 0:
+                _cache = ResponseCache(CACHE_PATH, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+            _cache_configured = True
+    return _cache
+
+
+def set_response_cache(cache: Optional[ResponseCache]) -> None:
+    """
+    Replace the search response cache, e.g. with one at a different path or TTL; None disables caching
+    """
+    global _cache, _cache_configured
+    with _cache_lock:
+        _cache = cache
+        _cache_configured = True
+
+
+def _extract_year(published: Optional[str]) -> Optional[str]:
+    """
+    Pull a four digit year out of a publication string such as "2024" or "2024-05-01"
+    """
+    match = re.search(r"\b(19|20)\d{2}\b", published or "")
+    return match.group() if match else None
+
+
+def _session() -> requests.Session:
+    """
+    One pooled keep-alive session per thread, since requests.Session is not thread-safe
+    """
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        _local.session = session
+    return session
 
 
 class Paper(BaseModel):
@@ -17,6 +86,8 @@ class Paper(BaseModel):
     published: Optional[str] = None
     paper_id: Optional[str] = None
     version: Optional[str] = None
+    score: Optional[float] = None
+    publication_date: Optional[str] = None
 
     def describe(self) -> str:
         return (
@@ -52,8 +123,15 @@ class Paper(BaseModel):
         }
 
     @classmethod
-    def fetch_papers_batch(cls, query: str, start_offset: int = 0, limit: int = 100, year="-2025", timeout: int = 20) -> List[Dict]:
+    def fetch_papers_batch(cls, query: str, start_offset: int = 0, limit: int = 100, year="-2025", timeout: int = 20,
+                           max_retries: int = MAX_RETRIES, use_cache: bool = True) -> List[Dict]:
         offset = start_offset * limit
+        cache = get_response_cache() if use_cache else None
+        key = ResponseCache.make_key(query, offset, limit, year, FIELDS)
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
         
         def _headers() -> Dict[str, str]:
             return {
@@ -63,11 +141,9 @@ class Paper(BaseModel):
                 # "x-api-key": os.getenv("SEMANTIC_SCHOLAR_API_KEY")  # Optional API key if needed
             }
 
-        # TODO: use offset to get training 1000 data
-        BASE_URL = "https://api.semanticscholar.org/graph/v1/paper/search"
         params = {
             "query": query,
-            "fields": "title,year,url,externalIds,citationCount,abstract",
+            "fields": FIELDS,
             "offset": offset,
             "limit": limit,
             "bulk": "true",
@@ -75,47 +151,115 @@ class Paper(BaseModel):
             "year": year,
         }
     
-        try:
-            print("Waiting for paper collection")
-            response = requests.get(BASE_URL, params=params, headers=_headers(), timeout=timeout)
-            if response.status_code == 429:
-                print("[WARN] Rate limited. Retrying...")
-                time.sleep(30.0)
-                response = requests.get(BASE_URL, params=params, headers=_headers(), timeout=timeout)
-    
+        print("Waiting for paper collection")
+        for attempt in range(max_retries + 1):
+            try:
+                RATE_LIMITER.acquire()
+                response = SEMANTIC_SCHOLAR.call(
+                    _session().get, BASE_URL, params=params, headers=_headers(), timeout=timeout,
+                    failure=lambda response: response.status_code >= 500,
+                )
+            except CircuitOpenError as e:
+                print(f"[ERROR] {e}")
+                return []
+            except Exception as e:
+                print(f"[ERROR] Exception occurred: {e}")
+                if attempt == max_retries:
+                    return []
+                time.sleep(backoff_delay(attempt))
+                continue
+
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt == max_retries:
+                    print(f"[ERROR] API request failed: {response.status_code}")
+                    return []
+                delay = parse_retry_after(response.headers.get("Retry-After"))
+                if delay is None:
+                    delay = backoff_delay(attempt)
+                if response.status_code == 429:
+                    # Pause the shared bucket so concurrent pages back off together, but never for longer than the cap
+                    RATE_LIMITER.pause(min(delay, MAX_RETRY_AFTER))
+                if delay > MAX_RETRY_AFTER:
+                    print(f"[ERROR] API asked to retry in {delay:.0f}s, beyond the {MAX_RETRY_AFTER:.0f}s budget - giving up")
+                    return []
+                print(f"[WARN] Got {response.status_code} for offset {offset}. Retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                continue
+
             if not response.ok:
                 print(f"[ERROR] API request failed: {response.status_code}")
                 return []
-    
-            data = response.json()
-            # for d in data.get("data", []):
-                # if d.get("abstract"):
-                #     print("OK")
-                # else:
-                #     print("NO")
-            return data.get("data", []) or []
-    
-        except Exception as e:
-            print(f"[ERROR] Exception occurred: {e}")
-            return []
+
+            try:
+                data = response.json()
+            except ValueError as e:
+                print(f"[ERROR] Exception occurred: {e}")
+                return []
+            result = data.get("data", []) or []
+            if cache is not None:
+                cache.set(key, result)
+            return result
+        return []
+
+    @classmethod
+    def from_api(cls, p: Dict) -> "Paper":
+        return cls(
+            title=p.get("title", ""),
+            abstract=p.get("abstract") or "",
+            citations=p.get("citationCount", -1),
+            url=p.get("url", ""),
+            published=str(p.get("year", "")) if p.get("year") else None,
+            paper_id=p.get("paperId", ""),
+            publication_date=p.get("publicationDate"),
+        )
 
     @classmethod    
-    def fetch(cls, query:str, start_offset: int = 0, limit:int=100, year="2024-2024") -> List["Paper"]:
+    def fetch(cls, query:str, start_offset: int = 0, limit:int=100, year="2024-2024", use_cache: bool = True) -> List["Paper"]:
+        scrapedPapers = cls.fetch_papers_batch(query, start_offset, limit, year, use_cache=use_cache)
+        return [cls.from_api(p) for p in scrapedPapers]
+
+    @classmethod
+    def fetch_since(cls, query: str, latest_date: Optional[str], seen_ids: List[str], limit: int = 100,
+                    max_pages: int = 10) -> List["Paper"]:
+        """
+        Fetch the papers published since a high-water mark, newest first
+        Results are sorted by publication date, so paging stops at the first paper older than latest_date;
+        papers in seen_ids are skipped (or end the scan when there is no date to go by).
+        Responses are never served from the cache
+        :param latest_date: the newest publication date (YYYY-MM-DD) seen on the previous poll
+        :param seen_ids: the paper ids already seen on that date
+        """
+        seen = set(seen_ids)
         papers = []
-        scrapedPapers = cls.fetch_papers_batch(query, start_offset, limit, year)
-        for p in scrapedPapers:
-            papers.append(
-                Paper(
-                    title=p.get("title", ""),
-                    abstract=p.get("abstract") or "",
-                    citations=p.get("citationCount", -1),
-                    url=p.get("url", ""),
-                    published=str(p.get("year", "")) if p.get("year") else None,
-                    paper_id=p.get("paperId", ""),
-                )
-            )
+        # Open-ended, so papers published after today still show up on later polls
+        year = f"{latest_date[:4]}-" if latest_date else None
+        for page in range(max_pages):
+            batch = cls.fetch(query, page, limit, year, use_cache=False)
+            for paper in batch:
+                if paper.paper_id in seen:
+                    if latest_date:
+                        continue
+                    return papers
+                if latest_date and paper.publication_date and paper.publication_date < latest_date:
+                    return papers
+                papers.append(paper)
+            if len(batch) < limit:
+                break
         return papers
 
+    @classmethod
+    def harvest(cls, query: str, pages: int = 10, start_offset: int = 0, limit: int = 100, year="2024-2024",
+                max_workers: int = 4) -> List["Paper"]:
+        """
+        Fetch `pages` consecutive pages of results concurrently over the shared session
+        The shared token bucket keeps the workers within the API rate limit
+        :return: the papers of all pages, in page order
+        """
+        page_numbers = range(start_offset, start_offset + pages)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, pages))) as executor:
+            batches = list(executor.map(lambda page: cls.fetch(query, page, limit, year), page_numbers))
+        return [paper for batch in batches for paper in batch]
+
 
 # test
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class Pipeline:
+    """
+    Run a chain of stages in their own threads, connected by bounded queues
+    Each stage maps one item to an iterable of output items, so a stage can filter, split or batch;
+    a full queue blocks the stage before it, which keeps memory flat however much the source produces.
+    Iterating the pipeline yields the output of the last stage as soon as it is ready.
+    """
+
+    def __init__(self, source: Iterable, stages: List[Callable[[Any], Iterable]], maxsize: int = 2,
+                 source_size: Optional[int] = None):
+        """
+        :param maxsize: how many items may wait between two stages
+        :param source_size: how many items may wait between the source and the first stage, if not maxsize
+        """
+        self.source = source
+        self.stages = stages
+        self.maxsize = maxsize
+        self.source_size = source_size or maxsize
+        self.stop = threading.Event()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _produce(self, output: queue.Queue) -> None:
+        try:
+            for item in self.source:
+                if not self._put(output, item):
+                    return
+        except BaseException as e:
+            self._put(output, _Failure(e))
+        self._put(output, _DONE)
+
+    def _work(self, stage: Callable[[Any], Iterable], inbox: queue.Queue, output: queue.Queue) -> None:
+        while True:
+            item = self._get(inbox)
+            if item is _DONE or isinstance(item, _Failure):
+                self._put(output, item)
+                return
+            try:
+                for result in stage(item):
+                    if not self._put(output, result):
+                        return
+            except BaseException as e:
+                self._put(output, _Failure(e))
+                return
+
+    def __iter__(self) -> Iterator:
+        queues = [queue.Queue(maxsize=self.source_size)] + [queue.Queue(maxsize=self.maxsize) for _ in self.stages]
+        threads = [threading.Thread(target=self._produce, args=(queues[0],), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            threads.append(threading.Thread(target=self._work, args=(stage, queues[i], queues[i + 1]), daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            # Also reached when the consumer stops early, which lets every stage exit
+            self.stop.set()
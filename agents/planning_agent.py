@@ -1,25 +1,140 @@
-from typing import Optional, List
+import threading
+import time
+from typing import Callable, Iterator, Optional, List
 from PaperAgent.agents.agent import Agent
-from PaperAgent.agents.scanner_agent import ScannerAgent
-from PaperAgent.agents.evaluate_agent import EvaluateAgent
-from PaperAgent.agents.messaging_agent import MessagingAgent
+from PaperAgent.agents.metrics import timed
 from PaperAgent.agents.papers import Paper
+from PaperAgent.agents.ranking import TopKRanker
+
+
+class _Citations:
+    """
+    The citations of some papers, only formatted if the log message that shows them is emitted
+    """
+
+    def __init__(self, papers: List[Paper]):
+        self.papers = papers
+
+    def __str__(self) -> str:
+        return str([f"{paper.citations:.2f}" for paper in self.papers])
+
 
 class PlanningAgent(Agent):
 
     name = "Planning Agent"
     color = Agent.GREEN
 
-    def __init__(self, collection):
+    SEEN_PATH = "cache/seen.sqlite"
+    WATERMARK_PATH = "cache/watermarks.sqlite"
+
+    def __init__(self, collection, use_evaluator: bool = False, remember: bool = True, flights=None,
+                 notify: bool = False, pages: int = 1, scanner=None, evaluator=None, messenger=None,
+                 use_predictor: bool = True, predictor=None):
         """
-        Create instances of the 3 Agents that this planner coordinates across
+        Set up the planner; the 3 Agents that it coordinates across are created the first time they are used,
+        or all at once by warm_up()
+        :param use_evaluator: estimate the citations of the selected papers with the EvaluateAgent
+        :param remember: keep a persistent index of surfaced papers, and skip them in later runs
+        :param flights: a SingleFlight shared by concurrent plan calls, so identical queries, fetches,
+            selections and paper evaluations in flight at the same time are only done once
+        :param notify: send the MessagingAgent a single digest of each run's best papers
+        :param pages: how many pages of 50 papers each plan harvests
+        :param scanner: use this agent instead of creating a ScannerAgent; likewise evaluator and messenger
+        :param use_predictor: when the evaluator is off, estimate citations with the local CitationPredictor,
+            if a trained model exists
+        :param predictor: use this CitationPredictor instead of loading the saved model
         """
         self.log("Planning Agent is initializing")
-        self.scanner = ScannerAgent()
-        # self.evaluate = EvaluateAgent(collection) ################### TODO:!!!!!!!!!!!!!!!!!!!!!!!!!!!
-        self.messenger = MessagingAgent()        ################### TODO:!!!!!!!!!!!!!!!!!!!!!!!!!!!
+        self.collection = collection
+        self.use_evaluator = use_evaluator
+        self.remember = remember
+        self.flights = flights
+        self.notify = notify
+        self.pages = pages
+        self._seen = None
+        self._watermarks = None
+        self._scanner = scanner
+        self._evaluator = evaluator
+        self._messenger = messenger
+        self.use_predictor = use_predictor
+        self._predictor = predictor
+        self.startup_times = {}
+        # One lock per lazily created component, so concurrent workers create each of them only once
+        self.locks = {component: threading.Lock()
+                      for component in ("scanner", "evaluator", "messenger", "predictor", "seen", "watermarks")}
         self.log("Planning Agent is ready")
 
+    def _timed(self, component: str, factory):
+        start = time.perf_counter()
+        result = factory()
+        self.startup_times[component] = time.perf_counter() - start
+        self.log(f"Planning Agent started {component} in {self.startup_times[component]:.2f}s")
+        return result
+
+    @property
+    def scanner(self):
+        with self.locks["scanner"]:
+            if self._scanner is None:
+                from PaperAgent.agents.scanner_agent import ScannerAgent
+                self._scanner = self._timed("scanner", ScannerAgent)
+            return self._scanner
+
+    @property
+    def evaluator(self):
+        with self.locks["evaluator"]:
+            if self._evaluator is None:
+                from PaperAgent.agents.evaluate_agent import EvaluateAgent
+                self._evaluator = self._timed("evaluator", lambda: EvaluateAgent(self.collection))
+            return self._evaluator
+
+    @property
+    def messenger(self):
+        with self.locks["messenger"]:
+            if self._messenger is None:
+                from PaperAgent.agents.messaging_agent import MessagingAgent
+                self._messenger = self._timed("messenger", MessagingAgent)
+            return self._messenger
+
+    @property
+    def predictor(self):
+        """
+        The local citation predictor, or None when it is off or no model has been trained yet
+        """
+        if not self.use_predictor:
+            return None
+        with self.locks["predictor"]:
+            if self._predictor is None:
+                from PaperAgent.agents.citation_predictor import CitationPredictor
+                self._predictor = self._timed("predictor", CitationPredictor)
+        return self._predictor if self._predictor.trained else None
+
+    @property
+    def seen(self):
+        """
+        The index of papers surfaced by earlier runs, or None when remember is off
+        """
+        with self.locks["seen"]:
+            if self._seen is None and self.remember:
+                from PaperAgent.agents.seen_index import SeenIndex
+                self._seen = self._timed("seen_index", lambda: SeenIndex(self.SEEN_PATH))
+            return self._seen
+
+    def warm_up(self, evaluator: bool = False) -> dict:
+        """
+        Create every agent and load the embedding model up front, for long-running workers
+        :param evaluator: also load the ensemble and each of its models
+        :return: seconds spent starting each component
+        """
+        from PaperAgent.agents.embeddings import get_embedding_service
+        self.scanner
+        self.messenger
+        self.seen
+        self._timed("embeddings", lambda: get_embedding_service().model)
+        self.predictor
+        if evaluator:
+            self.startup_times.update(self.evaluator.warm_up())
+        return dict(self.startup_times)
+
     def run(self, paper: Paper) -> Paper:
         """
         Run the workflow for a particular paper
@@ -27,16 +142,74 @@ class PlanningAgent(Agent):
         :returns: an Paper including the citation
         """
         self.log("Planning Agent is evaluating the a potential influence of seleted papers")
-        
-        # # estimate = self.evaluate.evaluate(paper.describe) ###### TODO:!!!!!!!!!!!!!!!!!
-        # self.log(f"Planning Agent has evaluate the paper with influence as ${estimate:.2f}")
-        # paper.citations = estimate # update estimated citations to current paper
-        
+        predictor = self.predictor
+        if predictor is not None:
+            estimate = float(predictor.predict([paper])[0])
+            self.log("Planning Agent has evaluate the paper with influence as %.2f", estimate)
+            # Citations already received are a floor under the estimate
+            paper.citations = max(paper.citations, int(round(estimate)))
         return paper
 
+    @timed
+    def run_many(self, papers: List[Paper]) -> List[Paper]:
+        """
+        Run the workflow for a batch of papers with a single call to EvaluateAgent.evaluate_many,
+        or without the evaluator, a single local CitationPredictor.predict
+        :returns: the papers, with their citations replaced by the estimates when the evaluator is enabled,
+            or raised to the predicted citations when the predictor is
+        """
+        if not papers:
+            return papers
+        if not self.use_evaluator:
+            predictor = self.predictor
+            if predictor is None:
+                return papers
+            self.log("Planning Agent is predicting the citations of %d papers locally", len(papers))
+            for paper, estimate in zip(papers, predictor.predict(papers)):
+                paper.citations = max(paper.citations, int(round(estimate)))
+            return papers
+        self.log("Planning Agent is evaluating the potential influence of %d papers in one batch", len(papers))
+        descriptions = [paper.make_model_input() for paper in papers]
+        if self.flights is None:
+            estimates = self.evaluator.evaluate_many(descriptions)
+        else:
+            estimates = self.flights.do_many(
+                [("evaluate", description) for description in descriptions],
+                lambda positions: self.evaluator.evaluate_many([descriptions[i] for i in positions]),
+            )
+        for paper, estimate in zip(papers, estimates):
+            paper.citations = int(round(estimate))
+        return papers
+
+    @timed
+    def scan(self, user_request: str, memory):
+        """
+        Run the scanner for this request; with flights set, each stage is shared with identical
+        requests that are in flight at the same time
+        """
+        scanner = self.scanner
+        if self.flights is None:
+            return scanner.scan(memory=memory, user_request=user_request, pages=self.pages)
+        request = " ".join(user_request.split()).lower()
+        query = self.flights.do(
+            ("query", request), lambda: scanner.generate_query(user_request) if scanner.use_llm else user_request
+        )
+        scraped = scanner.filter_seen(memory, self.flights.do(("fetch", query), lambda: scanner.fetch_batch(None, query, pages=self.pages)))
+        if not scraped:
+            return None
+        candidates = tuple(paper.paper_id or paper.url for paper in scraped.rows())
+        selection = self.flights.do(
+            ("select", request, candidates), lambda: scanner.select_candidates(user_request, scraped)
+        )
+        if selection is None:
+            return None
+        # Every caller gets its own copies, since evaluation updates the papers in place
+        return selection.model_copy(update={"papers": [paper.model_copy() for paper in selection.papers]})
+
     """
     Make it more flexible ???
     """
+    @timed
     def plan(self, memory: List[str] = [], user_request="Give me 5 most recent papers in CS") -> Optional[Paper]:
         """
         Run the full workflow:
@@ -47,17 +220,164 @@ class PlanningAgent(Agent):
         :return: an Opportunity if one was surfaced, otherwise None
         """
         self.log("Planning Agent is kicking off a run")
-        selection = self.scanner.scan(memory=None, user_request=user_request)
+        seen = self.seen
+        if seen is not None and memory:
+            seen.add_urls(memory)
+        selection = self.scan(user_request, seen if seen is not None else memory)
         if selection:
-            rankPapers = [self.run(paper) for paper in selection.papers] #.papers[:5] top 20
-            rankPapers.sort(key=lambda rankPapers: rankPapers.citations, reverse=True) #TODO: change it to use model to predict
-            best = rankPapers[:5]
-            self.log(f"Planning Agent has identified the most influential paper which has citations {[f'{ele.citations:.2f}' for ele in best]}")
-            # self.messenger.alert(best) #TODO:message agent
+            # run_many has replaced the raw citations with the evaluator's or predictor's estimates
+            ranker = TopKRanker(5, key=lambda paper: paper.citations)
+            ranker.extend(self.run_many(selection.papers)) #.papers[:5] top 20
+            best = ranker.results()
+            self.log("Planning Agent has identified the most influential paper which has citations %s",
+                     _Citations(best))
+            if self.notify:
+                self.messenger.alert_digest(best)
+            # Only the papers actually surfaced are remembered, and only once they have been
+            if seen is not None:
+                seen.add_many(best)
             self.log("Planning Agent has completed a run")
             return best
         return None
 
+    def plan_stream(self, user_request="Give me 5 most recent papers in CS", pages: int = 5,
+                    queue_size: int = 2, notify: Optional[Callable[[Paper], None]] = None,
+                    ranker: Optional[TopKRanker] = None, patience: int = 2) -> Iterator[Paper]:
+        """
+        Run the workflow as a pipeline: each page of papers is selected, evaluated and notified
+        while the following pages are still being fetched
+        Stages run in their own threads with bounded queues between them, so memory stays flat
+        :param pages: how many pages of results to harvest
+        :param queue_size: how many batches may wait between two stages
+        :param notify: called for each evaluated paper, e.g. self.messenger.alert
+        :param ranker: evaluated papers are pushed into this ranker; when the scanner ranks locally,
+            pages whose best pre-ranker score cannot beat the ranker's threshold are skipped,
+            and fetching stops after `patience` such pages in a row
+        Without a ranker each paper is remembered as surfaced once it has been notified and yielded;
+        with one, only the papers the ranker keeps are, once the stream is complete
+        :return: an iterator over the evaluated papers, in the order they are ready
+        """
+        from PaperAgent.agents.pipeline import Pipeline
+        self.log("Planning Agent is kicking off a streaming run")
+        scanner = self.scanner
+        query = scanner.generate_query(user_request) if scanner.use_llm else user_request
+        # The pre-ranker bound is only comparable with the ranker's scores when selection is local
+        prune = ranker is not None and not scanner.use_llm
+        exhausted = threading.Event()
+        misses = 0
+
+        seen = self.seen
+
+        def source():
+            # Checked before every fetch, so pruning saves the API calls and not just the selections
+            yield from scanner.iter_pages(seen, query, pages, should_stop=exhausted.is_set)
+            if exhausted.is_set():
+                self.log("Planning Agent stopped fetching - %d pages in a row could not enter the top K", patience)
+
+        def select(page: List[Paper]):
+            nonlocal misses
+            if prune:
+                bound = float(scanner.pre_ranker.scores(user_request, page).max())
+                if not ranker.can_improve(bound):
+                    misses += 1
+                    if misses >= patience:
+                        exhausted.set()
+                    return
+                misses = 0
+            selection = scanner.select_candidates(user_request, page)
+            if selection and selection.papers:
+                yield selection.papers
+
+        def evaluate(papers: List[Paper]):
+            yield from self.run_many(papers)
+
+        def deliver(paper: Paper):
+            if ranker is not None:
+                ranker.push(paper)
+            if notify:
+                notify(paper)
+            yield paper
+
+        # While pruning, prefetch a single page, so few pages are fetched past the point of stopping
+        pipeline = Pipeline(source(), [select, evaluate, deliver], maxsize=queue_size, source_size=1 if prune else None)
+        for paper in pipeline:
+            yield paper
+            if seen is not None and ranker is None:
+                seen.add_many([paper])
+        if seen is not None and ranker is not None:
+            seen.add_many(ranker.results())
+        self.log("Planning Agent has completed a streaming run")
+
+    def plan_top_k(self, user_request="Give me 5 most recent papers in CS", k: int = 5, pages: int = 20,
+                   patience: int = 2) -> List[Paper]:
+        """
+        Stream a large harvest through plan_stream into a bounded top-K heap, ranked by relevance score,
+        stopping early once `patience` pages in a row had nothing to beat the K-th score
+        Pages come sorted by date rather than relevance, so this is a heuristic: a later page could still hold a better paper
+        :return: the k best papers, best first
+        """
+        ranker = TopKRanker(k, key=lambda paper: paper.score if paper.score is not None else float("-inf"))
+        for _ in self.plan_stream(user_request, pages=pages, ranker=ranker, patience=patience):
+            pass
+        best = ranker.results()
+        self.log("Planning Agent ranked %d papers into the top %d", ranker.seen, len(best))
+        return best
+
+    @property
+    def watermarks(self):
+        with self.locks["watermarks"]:
+            if self._watermarks is None:
+                from PaperAgent.agents.watch import WatermarkStore
+                self._watermarks = WatermarkStore(self.WATERMARK_PATH)
+            return self._watermarks
+
+    @timed
+    def poll(self, user_request: str, notify: Optional[Callable[[Paper], None]] = None) -> List[Paper]:
+        """
+        One incremental run: fetch only the papers published since this request's high-water mark,
+        then select and evaluate just that delta
+        :param notify: called for each surfaced paper, before it is remembered as surfaced
+        :return: the selected papers among the new publications, best first
+        """
+        scanner = self.scanner
+        query = scanner.generate_query(user_request) if scanner.use_llm else user_request
+        # The mark is kept per (normalized) request: the generated query can differ from one poll to the next
+        latest_date, seen_ids = self.watermarks.get(user_request)
+        fetched = Paper.fetch_since(query, latest_date, seen_ids)
+        self.log("Planning Agent found %d papers published since %s", len(fetched), latest_date or "the first poll")
+        delta = scanner.filter_seen(self.seen, [paper for paper in fetched if paper.abstract])
+        best = []
+        if delta:
+            selection = scanner.select_candidates(user_request, delta)
+            if selection and selection.papers:
+                ranker = TopKRanker(5, key=lambda paper: paper.citations)
+                ranker.extend(self.run_many(selection.papers))
+                best = ranker.results()
+                if notify:
+                    for paper in best:
+                        notify(paper)
+                if self.seen is not None:
+                    self.seen.add_many(best)
+        # Only advance the mark once the delta has been handled, so a failed poll is retried
+        self.watermarks.advance(user_request, fetched)
+        return best
+
+    def watch(self, user_request: str, interval: float = 3600, iterations: Optional[int] = None,
+              notify: Optional[Callable[[Paper], None]] = None) -> Iterator[List[Paper]]:
+        """
+        Poll for new publications every `interval` seconds, yielding the papers surfaced by each poll
+        :param iterations: stop after this many polls; None keeps watching forever
+        :param notify: called for each surfaced paper
+        """
+        count = 0
+        while iterations is None or count < iterations:
+            start = time.monotonic()
+            papers = self.poll(user_request, notify=notify)
+            yield papers
+            count += 1
+            if iterations is None or count < iterations:
+                time.sleep(max(0.0, interval - (time.monotonic() - start)))
+
 # test
 # RUN: python -m PaperAgent.agents.scanner_agent
 if __name__ == "__main__":
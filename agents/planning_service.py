@@ -0,0 +1,52 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+
+from PaperAgent.agents.agent import Agent
+from PaperAgent.agents.papers import Paper
+from PaperAgent.agents.planning_agent import PlanningAgent
+from PaperAgent.agents.single_flight import SingleFlight
+
+
+class PlanningService(Agent):
+    """
+    Serve many users' plan requests concurrently from one shared PlanningAgent
+    Identical work in flight at the same time (query rewrites, fetches, selections and
+    paper evaluations) is coalesced, so API traffic grows with distinct work rather than with users
+    """
+
+    name = "Planning Service"
+    color = Agent.GREEN
+
+    def __init__(self, collection, workers: int = 8, **planner_options):
+        """
+        :param workers: how many plan requests are served at once
+        :param planner_options: passed on to the PlanningAgent; the shared seen index is off by default,
+            since each user's history is passed to submit() as their memory instead
+        """
+        self.log(f"Planning Service is starting with {workers} workers")
+        planner_options.setdefault("remember", False)
+        self.flights = SingleFlight()
+        self.planner = PlanningAgent(collection, flights=self.flights, **planner_options)
+        # Create the shared agents up front, so concurrent first requests don't race to build them
+        self.startup_times = self.planner.warm_up(evaluator=self.planner.use_evaluator)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="planner")
+        self.log("Planning Service is ready")
+
+    def submit(self, user_request: str, memory: Optional[List[str]] = None) -> Future:
+        """
+        Queue a plan request
+        :return: a Future for the papers that plan returns
+        """
+        return self.executor.submit(self.planner.plan, memory or [], user_request)
+
+    def plan_all(self, user_requests: List[str]) -> List[Optional[List[Paper]]]:
+        """
+        Serve a batch of requests concurrently, returning their results in the same order
+        """
+        return [future.result() for future in [self.submit(request) for request in user_requests]]
+
+    def stats(self) -> dict:
+        return self.flights.stats()
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.executor.shutdown(wait=wait)
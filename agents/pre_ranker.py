@@ -0,0 +1,55 @@
+from typing import List, Tuple
+import numpy as np
+
+from PaperAgent.agents.agent import Agent
+from PaperAgent.agents.metrics import timed
+from PaperAgent.agents.papers import Paper
+from PaperAgent.agents.embeddings import get_embedding_service
+
+
+class PreRanker(Agent):
+    """
+    Rank papers locally by cosine similarity between the query and each abstract,
+    using the same MiniLM encoder as the Frontier and Random Forest agents
+    """
+
+    name = "Pre-Ranker"
+    color = Agent.CYAN
+
+    def __init__(self):
+        self.embeddings = get_embedding_service()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        vectors = self.embeddings.encode_many(texts)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    @timed
+    def scores(self, query: str, papers: List[Paper]) -> np.ndarray:
+        """
+        Cosine similarity of the query against every paper abstract, as one matrix-vector product
+        :param papers: a list of papers, or a PaperBatch
+        """
+        if not len(papers):
+            return np.zeros(0, dtype=np.float32)
+        query_vector = self.encode([query])[0]
+        if hasattr(papers, "texts"):
+            texts = papers.texts()
+        else:
+            texts = [paper.abstract or paper.title for paper in papers]
+        matrix = self.encode(texts)
+        return matrix @ query_vector
+
+    def top_k(self, query: str, papers: List[Paper], k: int) -> List[Tuple[Paper, float]]:
+        """
+        Return the k most similar papers with their scores, best first
+        From a PaperBatch, only these k papers are materialized
+        """
+        scores = self.scores(query, papers)
+        k = min(k, len(papers))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        self.log("Pre-Ranker kept %d of %d papers", k, len(papers))
+        return [(papers[i], float(scores[i])) for i in top]
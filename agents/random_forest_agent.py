@@ -3,9 +3,9 @@
 import os
 import re
 from typing import List
-from sentence_transformers import SentenceTransformer
-import joblib
 from PaperAgent.agents.agent import Agent
+from PaperAgent.agents.metrics import timed
+from PaperAgent.agents.embeddings import get_embedding_service
 
 
 
@@ -14,16 +14,21 @@ class RandomForestAgent(Agent):
     name = "Random Forest Agent"
     color = Agent.MAGENTA
 
-    def __init__(self):
+    def __init__(self, model=None):
         """
         Initialize this object by loading in the saved model weights
         and the SentenceTransformer vector encoding model
+        :param model: use this fitted regressor instead of loading random_forest_model.pkl
         """
         self.log("Random Forest Agent is initializing")
-        self.vectorizer = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-        self.model = joblib.load('random_forest_model.pkl')
+        self.vectorizer = get_embedding_service()
+        if model is None:
+            import joblib
+            model = joblib.load('random_forest_model.pkl')
+        self.model = model
         self.log("Random Forest Agent is ready")
 
+    @timed
     def price(self, description: str) -> float:
         """
         Use a Random Forest model to estimate the price of the described item
@@ -33,5 +38,16 @@ class RandomForestAgent(Agent):
         self.log("Random Forest Agent is starting a prediction")
         vector = self.vectorizer.encode([description])
         result = max(0, self.model.predict(vector)[0])
-        self.log(f"Random Forest Agent completed - predicting ${result:.2f}")
-        return result
\ No newline at end of file
+        self.log("Random Forest Agent completed - predicting $%.2f", result)
+        return result
+
+    @timed
+    def price_many(self, descriptions: List[str]) -> List[float]:
+        """
+        Estimate many items with one batched encode and a single vectorized predict
+        """
+        if not descriptions:
+            return []
+        self.log("Random Forest Agent is starting %d predictions", len(descriptions))
+        vectors = self.vectorizer.encode_many(descriptions)
+        return [max(0, result) for result in self.model.predict(vectors)]
@@ -0,0 +1,64 @@
+import heapq
+import itertools
+import threading
+from typing import Any, Callable, List
+
+
+class TopKRanker:
+    """
+    Keep the k best items seen so far in a bounded min-heap, so ranking a stream
+    takes O(n log k) time and O(k) memory instead of holding and sorting everything
+    """
+
+    def __init__(self, k: int, key: Callable[[Any], float]):
+        self.k = k
+        self.key = key
+        self.heap = []
+        self.counter = itertools.count()
+        self.seen = 0
+        self.lock = threading.Lock()
+
+    def push(self, item) -> bool:
+        """
+        Offer an item to the ranking
+        :return: True if it is currently among the top k
+        """
+        entry = (self.key(item), next(self.counter), item)
+        with self.lock:
+            self.seen += 1
+            if len(self.heap) < self.k:
+                heapq.heappush(self.heap, entry)
+                return True
+            if entry[0] > self.heap[0][0]:
+                heapq.heapreplace(self.heap, entry)
+                return True
+            return False
+
+    def extend(self, items) -> None:
+        for item in items:
+            self.push(item)
+
+    @property
+    def full(self) -> bool:
+        return len(self.heap) >= self.k
+
+    @property
+    def threshold(self) -> float:
+        """
+        The score an item has to beat to enter the ranking: the k-th best score, or -inf until k items are in
+        """
+        with self.lock:
+            return self.heap[0][0] if len(self.heap) >= self.k else float("-inf")
+
+    def can_improve(self, bound: float) -> bool:
+        """
+        Whether a candidate whose score is at most `bound` could still enter the top k
+        """
+        return bound > self.threshold
+
+    def results(self) -> List[Any]:
+        """
+        The current top k, best first
+        """
+        with self.lock:
+            return [item for _, _, item in sorted(self.heap, key=lambda entry: (-entry[0], entry[1]))]
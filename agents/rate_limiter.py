@@ -0,0 +1,69 @@
+import random
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket used to pace outbound API calls
+    Refills at `rate` tokens per second up to `capacity`, and can be paused
+    for a fixed period when a server tells us to back off (Retry-After)
+    """
+
+    def __init__(self, rate: float = 1.0, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """
+        Block until `tokens` are available, then take them
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= tokens:
+                        self.tokens -= tokens
+                        return
+                    wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stop handing out tokens for `seconds`, shared by every caller of this bucket
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """
+    Full-jitter exponential backoff: a random delay in [0, min(cap, base * 2^attempt)]
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Read a Retry-After header given in seconds; HTTP-date values are ignored
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
@@ -0,0 +1,255 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+from PaperAgent.agents import metrics
+from PaperAgent.agents.rate_limiter import backoff_delay
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised without calling the backend while its circuit breaker is open
+    """
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when no attempt (original or hedge) completes before the endpoint's deadline
+    """
+
+    def __init__(self, message: str, started: bool = True):
+        super().__init__(message)
+        # False when no attempt ever reached the backend, i.e. the time went waiting for a worker
+        self.started = started
+
+
+class LatencyStats:
+    """
+    A rolling window of recent call latencies, with request and error counters
+    """
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool) -> None:
+        with self.lock:
+            self.requests += 1
+            if ok:
+                self.samples.append(seconds)
+            else:
+                self.errors += 1
+
+    def record_hedge(self) -> None:
+        with self.lock:
+            self.hedges += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self.lock:
+            if not self.samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    def summary(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "hedges": self.hedges,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class CircuitBreaker:
+    """
+    Open after `failure_threshold` consecutive failures, fail fast for `reset_timeout` seconds,
+    then let a single trial call through (half-open) to decide whether to close again
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def release(self) -> None:
+        """
+        A call was let through but never reached the backend: neither a success nor a failure
+        """
+        with self.lock:
+            self.trial = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+
+class Endpoint:
+    """
+    A resilient wrapper for calls to one backend: a deadline per attempt, a hedged duplicate
+    once the attempt has run longer than the recent p95, jittered retries, and a circuit breaker
+    Each endpoint runs its attempts on its own bounded pool, so a slow backend cannot take the workers of another
+    """
+
+    def __init__(self, name: str, deadline: float = 30.0, retries: int = 2, hedge: bool = True,
+                 hedge_min_samples: int = 20, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 max_workers: int = 16, timeout_kwarg: Optional[str] = None):
+        """
+        :param deadline: seconds an attempt may take before it is abandoned
+        :param retries: further attempts after a failed one
+        :param hedge: send a duplicate request when an attempt is slower than p95; only for idempotent calls
+        :param hedge_min_samples: how many latencies to collect before p95 is trusted for hedging
+        :param max_workers: attempts that may be in flight at once on this endpoint
+        :param timeout_kwarg: the keyword through which fn takes a client-side timeout (e.g. "timeout");
+            each attempt gets what is left of its deadline, so an abandoned attempt stops instead of holding a worker
+        """
+        self.name = name
+        self.deadline = deadline
+        self.retries = retries
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.timeout_kwarg = timeout_kwarg
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.stats = LatencyStats()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"endpoint-{name}")
+
+    def _hedge_after(self) -> Optional[float]:
+        if not self.hedge or len(self.stats.samples) < self.hedge_min_samples:
+            return None
+        p95 = self.stats.percentile(95)
+        return p95 if p95 is not None and p95 < self.deadline else None
+
+    def _run(self, fn: Callable, args, kwargs, start: float):
+        """
+        One attempt on a worker, with the client timeout capped at what is left of the deadline
+        """
+        remaining = self.deadline - (time.monotonic() - start)
+        if remaining <= 0:
+            raise DeadlineExceeded(f"{self.name} had no free worker within {self.deadline:.0f}s", started=False)
+        if self.timeout_kwarg is not None:
+            timeout = kwargs.get(self.timeout_kwarg)
+            kwargs = {**kwargs, self.timeout_kwarg: remaining if timeout is None else min(timeout, remaining)}
+        return fn(*args, **kwargs)
+
+    def _attempt(self, fn: Callable, args, kwargs):
+        start = time.monotonic()
+        pending = {self.executor.submit(self._run, fn, args, kwargs, start)}
+        hedge_after = self._hedge_after()
+        if hedge_after is not None:
+            done, pending = wait(pending, timeout=hedge_after)
+            if not done:
+                self.stats.record_hedge()
+                pending.add(self.executor.submit(self._run, fn, args, kwargs, start))
+            else:
+                pending = done
+        error = None
+        while pending:
+            remaining = self.deadline - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result(), time.monotonic() - start
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        # Attempts still waiting for a worker never reached the backend
+        started = not all([future.cancel() for future in pending])
+        raise DeadlineExceeded(f"{self.name} did not respond within {self.deadline:.0f}s", started=started)
+
+    def call(self, fn: Callable, *args, failure: Optional[Callable[[Any], bool]] = None, **kwargs):
+        """
+        Call fn(*args, **kwargs) under this endpoint's policy
+        :param failure: classifies a returned value as a failed call (e.g. an HTTP 5xx response);
+            such a value is still returned, but counts against the breaker and is not retried here
+        """
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                metrics.increment("endpoint_requests_total", endpoint=self.name, outcome="rejected")
+                raise CircuitOpenError(f"{self.name} is unavailable - circuit breaker is open")
+            start = time.monotonic()
+            try:
+                result, elapsed = self._attempt(fn, args, kwargs)
+            except Exception as e:
+                self.stats.record(time.monotonic() - start, ok=False)
+                metrics.increment("endpoint_requests_total", endpoint=self.name, outcome="error")
+                if isinstance(e, DeadlineExceeded) and not e.started:
+                    # The endpoint is saturated, not failing: leave the breaker as it was
+                    self.breaker.release()
+                else:
+                    self.breaker.record_failure()
+                if attempt == self.retries:
+                    raise
+                time.sleep(backoff_delay(attempt))
+                continue
+            failed = failure is not None and failure(result)
+            self.stats.record(elapsed, ok=not failed)
+            metrics.observe("endpoint_seconds", elapsed, endpoint=self.name)
+            metrics.increment("endpoint_requests_total", endpoint=self.name, outcome="error" if failed else "ok")
+            if failed:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return result
+
+    def summary(self) -> dict:
+        return {"state": self.breaker.state, **self.stats.summary()}
+
+
+_endpoints: Dict[str, Endpoint] = {}
+_endpoints_lock = threading.Lock()
+
+
+def endpoint(name: str, **config) -> Endpoint:
+    """
+    The shared Endpoint with this name, created with `config` the first time it is asked for
+    """
+    with _endpoints_lock:
+        if name not in _endpoints:
+            _endpoints[name] = Endpoint(name, **config)
+        return _endpoints[name]
+
+
+def stats() -> Dict[str, dict]:
+    """
+    Latency percentiles, counters and breaker state for every endpoint
+    """
+    with _endpoints_lock:
+        return {name: e.summary() for name, e in _endpoints.items()}
@@ -0,0 +1,108 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from PaperAgent.agents import metrics
+
+
+class ResponseCache:
+    """
+    A persistent key/value cache for JSON-serializable API responses, backed by SQLite
+    Entries expire after `ttl` seconds, and once more than `max_entries` are stored
+    the least recently used ones are evicted
+    """
+
+    def __init__(self, path: str = "cache/responses.sqlite", ttl: float = 24 * 3600, max_entries: int = 10_000,
+                 touch_interval: Optional[float] = None):
+        """
+        :param touch_interval: a hit only records its access time once the stored one is this many seconds old,
+            so most hits are a read alone; defaults to a tenth of the ttl (10 minutes without one)
+        """
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.ttl = ttl
+        self.max_entries = max_entries
+        if touch_interval is None:
+            touch_interval = ttl / 10 if ttl else 600.0
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """
+        Build a stable key from the parts of a request; strings are whitespace-normalized and lower-cased
+        """
+        def normalize(part):
+            if isinstance(part, str):
+                return " ".join(part.split()).lower()
+            return part
+        return json.dumps([normalize(part) for part in parts], sort_keys=True, default=str)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Return the cached value for this key, or None if it is missing or expired
+        """
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, created, accessed FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                if row is not None:
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.conn.commit()
+                self.misses += 1
+                metrics.increment("cache_misses_total", cache=self.name)
+                return None
+            # Eviction only needs a coarse recency, so the write is skipped for recently touched entries
+            if now - row[2] > self.touch_interval:
+                self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                self.conn.commit()
+            self.hits += 1
+        metrics.increment("cache_hits_total", cache=self.name)
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Store a value, evicting the least recently used entries if the cache is over its size cap
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            count = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self.conn.commit()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
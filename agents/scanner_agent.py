@@ -1,12 +1,21 @@
 import os
 import json
-from typing import Optional, List
-from openai import OpenAI
+import functools
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional, List, Union
 # from agents.papers import fetch_papers_batch #here we depend on PaperAgent to scrapt the new papers
 # from agents.agent import Agent
 from pydantic import BaseModel, Field
-from PaperAgent.agents.papers import Paper
+from PaperAgent.agents.papers import CACHE_TTL, Paper
+from PaperAgent.agents.paper_batch import PaperBatch
 from PaperAgent.agents.agent import Agent
+from PaperAgent.agents.metrics import record_usage, timed
+from PaperAgent.agents.pre_ranker import PreRanker
+from PaperAgent.agents.dedup import NearDuplicateFilter
+from PaperAgent.agents.llm_cache import SemanticCache, complete, get_llm_cache
+from PaperAgent.agents.seen_index import SeenIndex
+from PaperAgent.agents.resilience import endpoint
 from dotenv import load_dotenv
 
 # class PaperItem(BaseModel):
@@ -18,6 +27,13 @@ from dotenv import load_dotenv
 class PaperSelection(BaseModel):
     papers: List[Paper]
 
+class PaperScore(BaseModel):
+    index: int = Field(..., description="The [index] of the paper in the provided list")
+    score: float = Field(..., description="Relevance score in [0,1] based on abstract vs. user query")
+
+class PaperIndexSelection(BaseModel):
+    papers: List[PaperScore]
+
 class ScannerAgent(Agent):
     """
     Scan the latest 200 papers, and based on the semantic similarity between their abstracts and the user’s query, select the top 20 most relevant ones.
@@ -61,82 +77,356 @@ class ScannerAgent(Agent):
     Return exactly K items.
     """
 
+    # In "indices" mode the model only returns the [index] and score of each selected paper,
+    # and the papers themselves are rebuilt from the fetched list
+    INDEX_USER_PROMPT_PREFIX = """User query:
+    {query}
+    
+    Papers (each with an [index], Title and Abstract):
+    """
+
+    INDEX_USER_PROMPT_SUFFIX = """
+    Return JSON ONLY with this exact schema, using the [index] shown before each paper:
+    {{
+      "papers": [
+        {{
+          "index": 0,
+          "score": 0.0
+        }}
+      ]
+    }}
+    Return exactly {k} items.
+    """
+
     name = "Paper Scanner Agent"
     color = Agent.CYAN
 
-    def __init__(self):
+    def __init__(self, pre_rank_k: Optional[int] = 50, use_llm: bool = True, top_k: int = 20,
+                 selection_mode: str = "indices", similar_queries: bool = False, token_budget: int = 12_000,
+                 max_workers: int = 8, client=None, dedup: bool = True, corpus=None, offline: bool = False,
+                 corpus_max_age: Optional[float] = CACHE_TTL):
         """
         Set up this instance by initializing OpenAI
+        :param pre_rank_k: how many papers the local pre-ranker passes on to the LLM; None sends all of them
+        :param use_llm: when False, queries and selection are done entirely with the local pre-ranker
+        :param top_k: how many papers to select
+        :param selection_mode: "indices" to have the LLM return only indices and scores,
+            or "papers" to have it echo back every selected paper
+        :param similar_queries: reuse the query generated for a near-identical earlier request
+        :param token_budget: in "indices" mode, candidates that don't fit one prompt of this many tokens
+            are selected by a tournament of concurrent chunk calls
+        :param max_workers: how many chunk calls may be in flight at once
+        :param client: use this OpenAI-compatible client instead of connecting to OpenAI
+        :param dedup: collapse near-duplicate papers (e.g. arXiv versions and venue copies) as they are fetched
+        :param corpus: a CorpusStore; search pages are read from it first, and only pages it lacks are fetched
+        :param corpus_max_age: seconds after which a stored search page is fetched again, so new publications
+            and citation counts show up; defaults to the response cache TTL, and None keeps pages forever
+        :param offline: answer every query by full-text search of the corpus, without calling the API
         """
         load_dotenv()
         api_key = os.getenv("OPENAI_API_KEY")
         
         self.log("Scanner Agent is initializing")
-        self.openai = OpenAI(api_key=api_key)
+        self.pre_rank_k = pre_rank_k
+        self.use_llm = use_llm
+        self.top_k = top_k
+        self.selection_mode = selection_mode
+        self.token_budget = token_budget
+        self.max_workers = max_workers
+        self.pre_ranker = PreRanker()
+        self.dedup = NearDuplicateFilter() if dedup else None
+        self.corpus = corpus
+        self.offline = offline
+        self.corpus_max_age = corpus_max_age
+        if offline and corpus is None:
+            raise ValueError("offline mode needs a corpus")
+        if client is None and use_llm:
+            from openai import OpenAI
+            client = OpenAI(api_key=api_key)
+        self.openai = client
+        self.query_llm = endpoint("scanner.query", deadline=20.0, retries=2, timeout_kwarg="timeout")
+        self.selection_llm = endpoint("scanner.selection", deadline=90.0, retries=1, timeout_kwarg="timeout")
+        cache = get_llm_cache()
+        self.query_cache = SemanticCache(cache.cache, namespace="queries") if similar_queries and cache else None
         self.log("Scanner Agent is ready")
 
+    @timed
     def fetch_papers(self, memory, query) -> List[Paper]:
         """
         Look up new publised paper of a keyword on RSS feeds
-        Return 200 newest related papers
+        Return the newest related papers of the first page, as Paper objects; see fetch_batch for larger harvests
         """
         self.log("Scanner Agent is about to fetch papers from RSS feed")
-        
-        scraped = Paper.fetch(query, start_offset=0, limit=50)
+        scraped = self.fetch_page(query, 0, 50)
         # result = [scrape for scrape in scraped if scrape.abstract and scrape.citations!=None]
         result = [scrape for scrape in scraped if scrape.abstract] ## for prediction, citation can be None
+        result = self.filter_seen(memory, self.collapse_duplicates(result))
         
-        self.log(f"Scanner Agent received {len(result)} papers")
+        self.log("Scanner Agent received %d papers", len(result))
+        return result
+
+    @timed
+    def fetch_batch(self, memory, query, pages: int = 1) -> PaperBatch:
+        """
+        Harvest `pages` pages of 50 concurrently into a columnar PaperBatch,
+        so only the papers finally selected are ever materialized
+        """
+        self.log("Scanner Agent is about to harvest %d pages of papers", pages)
+        if self.offline:
+            batch = PaperBatch.from_papers(self.corpus.search(query, limit=50 * pages))
+        else:
+            fetch = None
+            if self.corpus is not None:
+                fetch = functools.partial(self.corpus.fetch_records, max_age=self.corpus_max_age)
+            batch = PaperBatch.harvest(query, pages=pages, start_offset=0, limit=50, fetch=fetch)
+        result = self.filter_seen(memory, self.collapse_duplicates(batch.with_abstract()))
+        self.log("Scanner Agent received %d papers", len(result))
         return result
 
+    def fetch_page(self, query: str, page: int, limit: int) -> List[Paper]:
+        """
+        One page of search results: from the corpus when there is one, otherwise straight from the API
+        """
+        if self.offline:
+            return self.corpus.search(query, limit=limit, offset=page * limit)
+        if self.corpus is not None:
+            return self.corpus.fetch(query, page, limit, max_age=self.corpus_max_age)
+        return Paper.fetch(query, start_offset=page, limit=limit)
+
+    def collapse_duplicates(self, papers):
+        """
+        Merge near-duplicate papers into their most cited copy, before they cost any tokens or evaluations
+        """
+        if self.dedup is None:
+            return papers
+        return self.dedup.collapse(papers)
+
+    def filter_seen(self, memory, papers: Union[List[Paper], PaperBatch]) -> Union[List[Paper], PaperBatch]:
+        """
+        Drop papers that were already surfaced
+        :param memory: a SeenIndex, a list of URLs surfaced in the past, or None to keep everything
+        :param papers: a list of papers, or a PaperBatch
+        """
+        if not memory:
+            return papers
+        before = len(papers)
+        if isinstance(papers, PaperBatch):
+            if isinstance(memory, SeenIndex):
+                papers = papers.take(np.fromiter((not memory.seen(row) for row in papers.rows()), dtype=bool, count=before))
+            else:
+                papers = papers.exclude_urls(memory)
+        elif isinstance(memory, SeenIndex):
+            papers = memory.filter(papers)
+        else:
+            urls = set(memory)
+            papers = [paper for paper in papers if paper.url not in urls]
+        if len(papers) < before:
+            self.log("Scanner Agent skipped %d papers that were already surfaced", before - len(papers))
+        return papers
+
+    def iter_pages(self, memory, query, pages: int = 1, limit: int = 50,
+                   should_stop: Optional[Callable[[], bool]] = None) -> Iterator[List[Paper]]:
+        """
+        Fetch pages one at a time, yielding the papers with an abstract as each page arrives
+        :param should_stop: checked before each fetch; once it returns True no further page is requested
+        """
+        for page in range(pages):
+            if should_stop is not None and should_stop():
+                self.log("Scanner Agent stopped before page %d", page)
+                return
+            scraped = self.fetch_page(query, page, limit)
+            result = self.filter_seen(memory, self.collapse_duplicates([scrape for scrape in scraped if scrape.abstract]))
+            self.log("Scanner Agent received %d papers from page %d", len(result), page)
+            if result:
+                yield result
+            if len(scraped) < limit:
+                return
+
+    @timed
     def generate_query(self, user_request: str) -> str:
         """
         Use LLM to transform a free-form user request into a concise search query
         suitable for academic paper retrieval.
         """
+        if self.query_cache is not None:
+            query = self.query_cache.get(user_request)
+            if query is not None:
+                self.log("Scanner Agent is reusing the query of a similar earlier request")
+                return query
         system_prompt = "You are an academic research assistant. Given a user request, produce a concise search query (5-10 words) that can be used to retrieve relevant academic papers. Only output the query."
-        result = self.openai.chat.completions.create(
+        result = complete(
+            self.openai,
+            via=self.query_llm,
             model=self.MODEL,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_request}
             ]
         )
-        return result.choices[0].message.content.strip()
+        query = result.strip()
+        if self.query_cache is not None:
+            self.query_cache.set(user_request, query)
+        return query
 
-    def make_user_prompt(self, scraped) -> str:
+    def make_user_prompt(self, scraped, query: str = "") -> str:
         """
         Create a user prompt for OpenAI based on the scraped papers provided
         """
-        user_prompt = self.USER_PROMPT_PREFIX
+        user_prompt = self.USER_PROMPT_PREFIX.format(query=query)
         user_prompt += '\n\n'.join([scrape.describe() for scrape in scraped])
         user_prompt += self.USER_PROMPT_SUFFIX
         return user_prompt
 
-    def scan(self, memory: List[str]=[], user_request: str="AI") -> Optional[PaperSelection]:
+    def make_index_prompt(self, scraped: List[Paper], query: str, k: int) -> str:
+        """
+        Create a user prompt that labels each paper with its index and omits everything but title and abstract
+        """
+        user_prompt = self.INDEX_USER_PROMPT_PREFIX.format(query=query)
+        user_prompt += '\n\n'.join(
+            f"[{i}]\nTitle: {scrape.title}\nAbstract: {scrape.abstract}" for i, scrape in enumerate(scraped)
+        )
+        user_prompt += self.INDEX_USER_PROMPT_SUFFIX.format(k=k)
+        return user_prompt
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """
+        Count tokens with tiktoken when it is installed, otherwise estimate 4 characters per token
+        """
+        try:
+            import tiktoken
+        except ImportError:
+            return len(text) // 4 + 1
+        return len(tiktoken.get_encoding("o200k_base").encode(text))
+
+    def chunk_by_tokens(self, query: str, scraped: List[Paper], k: int) -> List[List[int]]:
+        """
+        Split the papers into runs of indices whose index prompt fits within the token budget
+        """
+        overhead = self.estimate_tokens(self.SYSTEM_PROMPT + self.make_index_prompt([], query, k))
+        chunks, chunk, used = [], [], overhead
+        for i, scrape in enumerate(scraped):
+            tokens = self.estimate_tokens(f"[{i}]\nTitle: {scrape.title}\nAbstract: {scrape.abstract}\n\n")
+            if chunk and used + tokens > self.token_budget:
+                chunks.append(chunk)
+                chunk, used = [], overhead
+            chunk.append(i)
+            used += tokens
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def select_tournament(self, query: str, scraped: List[Paper], k: int) -> List[PaperScore]:
+        """
+        Map-reduce selection for candidate lists that don't fit in one prompt:
+        score token-budgeted chunks concurrently, then run the same selection over the chunk winners
+        until they fit in a single final call
+        :return: the valid selections as indices into scraped, best first
+        """
+        chunks = self.chunk_by_tokens(query, scraped, k)
+        if len(chunks) == 1:
+            return self.select_indices(query, scraped, k)
+        self.log("Scanner Agent is running a selection tournament over %d chunks", len(chunks))
+
+        def play(chunk: List[int]) -> List[PaperScore]:
+            choices = self.select_indices(query, [scraped[i] for i in chunk], k)
+            return [PaperScore(index=chunk[choice.index], score=choice.score) for choice in choices]
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(chunks)))) as executor:
+            winners = [choice for choices in executor.map(play, chunks) for choice in choices]
+        winners.sort(key=lambda choice: choice.score, reverse=True)
+        if len(winners) >= len(scraped):
+            # Chunks too small to eliminate anything: settle on the chunk scores
+            return winners[:k]
+        finalists = [scraped[choice.index] for choice in winners]
+        return [
+            PaperScore(index=winners[choice.index].index, score=choice.score)
+            for choice in self.select_tournament(query, finalists, k)
+        ]
+
+    @timed
+    def select_indices(self, query: str, scraped: List[Paper], k: int) -> List[PaperScore]:
+        """
+        Ask the LLM for the indices and scores of the k most relevant papers
+        Indices that are out of range or repeated are dropped
+        :return: the valid selections, best first
+        """
+        self.log("Scanner Agent is calling OpenAI using Structured Output for paper indices")
+        result = self.selection_llm.call(
+            self.openai.beta.chat.completions.parse,
+            model=self.MODEL,
+            messages=[
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": self.make_index_prompt(scraped, query, k)}
+            ],
+            response_format=PaperIndexSelection
+        )
+        record_usage(result, self.MODEL)
+        parsed = result.choices[0].message.parsed
+        seen = set()
+        selected = []
+        for choice in sorted(parsed.papers, key=lambda choice: choice.score, reverse=True):
+            if 0 <= choice.index < len(scraped) and choice.index not in seen:
+                seen.add(choice.index)
+                selected.append(choice)
+        return selected[:k]
+
+    @timed
+    def select(self, query: str, scraped: List[Paper]) -> PaperSelection:
+        """
+        Use the LLM to pick the top_k most relevant of the scraped papers
+        """
+        if self.selection_mode == "indices":
+            selected = self.select_tournament(query, scraped, self.top_k)
+            papers = [scraped[choice.index].model_copy(update={"score": choice.score}) for choice in selected]
+            self.log("Scanner Agent received %d selected paper indices from OpenAI", len(papers))
+            return PaperSelection(papers=papers)
+
+        user_prompt = self.make_user_prompt(scraped, query)
+        self.log("Scanner Agent is calling OpenAI using Structured Output")
+        result = self.selection_llm.call(
+            self.openai.beta.chat.completions.parse,
+            model=self.MODEL,
+            messages=[
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+          ],
+            response_format=PaperSelection
+        )
+        record_usage(result, self.MODEL)
+        result = result.choices[0].message.parsed
+        result.papers = [paper for paper in result.papers]
+        self.log("Scanner Agent received %d selected papers with price>0 from OpenAI", len(result.papers))
+        return result
+
+    def scan(self, memory: List[str]=[], user_request: str="AI", pages: int = 1) -> Optional[PaperSelection]:
         """
         Call OpenAI to provide a high potential list of papers with good descriptions and citations
         """
         # step1: get the query
-        query = self.generate_query(user_request)
+        query = self.generate_query(user_request) if self.use_llm else user_request
 
         # step2: search & select the top 20 most related
-        scraped = self.fetch_papers(memory, query)
+        scraped = self.fetch_batch(memory, query, pages=pages)
+        return self.select_candidates(user_request, scraped)
+
+    @timed
+    def select_candidates(self, user_request: str, scraped: Union[List[Paper], PaperBatch]) -> Optional[PaperSelection]:
+        """
+        Pre-rank the fetched papers locally, then select the top_k with the LLM (or locally when use_llm is off)
+        :param scraped: a list of papers, or a PaperBatch
+        """
+        if len(scraped) and not self.use_llm:
+            ranked = self.pre_ranker.top_k(user_request, scraped, self.top_k)
+            papers = [paper.model_copy(update={"score": score}) for paper, score in ranked]
+            self.log("Scanner Agent selected %d papers locally without calling OpenAI", len(papers))
+            return PaperSelection(papers=papers)
+        if len(scraped) and self.pre_rank_k and len(scraped) > self.pre_rank_k:
+            scraped = [paper for paper, _ in self.pre_ranker.top_k(user_request, scraped, self.pre_rank_k)]
+        if isinstance(scraped, PaperBatch):
+            scraped = scraped.to_papers()
         if scraped:
-            user_prompt = self.make_user_prompt(scraped)
-            self.log("Scanner Agent is calling OpenAI using Structured Output")
-            result = self.openai.beta.chat.completions.parse(
-                model=self.MODEL,
-                messages=[
-                    {"role": "system", "content": self.SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt}
-              ],
-                response_format=PaperSelection
-            )
-            result = result.choices[0].message.parsed
-            result.papers = [paper for paper in result.papers]
-            self.log(f"Scanner Agent received {len(result.papers)} selected papers with price>0 from OpenAI")
-            return result
+            return self.select(user_request, scraped)
         return None
                 
 # test
@@ -0,0 +1,95 @@
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, List
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter over strings, using double hashing of a SHA-256 digest
+    """
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.sha256(key.encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class SeenIndex:
+    """
+    A persistent record of the papers already surfaced, by paper_id and URL
+    Lookups go to an in-memory Bloom filter first, so the SQLite table is only
+    consulted for the (rare) keys the filter thinks it has seen
+    """
+
+    def __init__(self, path: str = "cache/seen.sqlite", capacity: int = 100_000):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY, surfaced REAL NOT NULL)")
+        self.conn.commit()
+        count = self.conn.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+        self.bloom = BloomFilter(capacity=max(capacity, 2 * count))
+        for (key,) in self.conn.execute("SELECT key FROM seen"):
+            self.bloom.add(key)
+
+    @staticmethod
+    def keys_for(paper) -> List[str]:
+        keys = []
+        if getattr(paper, "paper_id", None):
+            keys.append(f"id:{paper.paper_id}")
+        if getattr(paper, "url", None):
+            keys.append(f"url:{paper.url}")
+        return keys
+
+    def __contains__(self, key: str) -> bool:
+        if key not in self.bloom:
+            return False
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM seen WHERE key = ?", (key,)).fetchone() is not None
+
+    def seen(self, paper) -> bool:
+        return any(key in self for key in self.keys_for(paper))
+
+    def filter(self, papers: Iterable) -> List:
+        """
+        Keep only the papers that have not been surfaced before
+        """
+        return [paper for paper in papers if not self.seen(paper)]
+
+    def add_many(self, papers: Iterable) -> None:
+        """
+        Record these papers as surfaced
+        """
+        self._add_keys([key for paper in papers for key in self.keys_for(paper)])
+
+    def add_urls(self, urls: Iterable[str]) -> None:
+        """
+        Record plain URLs as surfaced, e.g. a memory list from an earlier version of the planner
+        """
+        self._add_keys([f"url:{url}" for url in urls if url])
+
+    def _add_keys(self, keys: List[str]) -> None:
+        now = time.time()
+        with self.lock:
+            self.conn.executemany("INSERT OR IGNORE INTO seen (key, surfaced) VALUES (?, ?)", [(key, now) for key in keys])
+            self.conn.commit()
+            for key in keys:
+                self.bloom.add(key)
@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List
+
+
+class SingleFlight:
+    """
+    Deduplicate identical work that is in flight at the same time
+    The first caller for a key runs the work; everyone else asking for that key
+    while it runs waits for, and shares, the same result (or exception)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: Dict[Hashable, Future] = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.calls[key] = future
+                self.executed += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+        future.set_result(result)
+        return result
+
+    def do_many(self, keys: List[Hashable], fn: Callable[[List[int]], List[Any]]) -> List[Any]:
+        """
+        Batch version of do: run fn once for the positions whose keys nobody else is working on,
+        and wait for the rest
+        :param fn: takes the positions (indices into keys) to compute and returns their results in that order
+        :return: a result for every key, in order
+        """
+        futures: Dict[Hashable, Future] = {}
+        claimed: List[int] = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in futures:
+                    continue
+                future = self.calls.get(key)
+                if future is None:
+                    future = Future()
+                    self.calls[key] = future
+                    claimed.append(i)
+                    self.executed += 1
+                else:
+                    self.shared += 1
+                futures[key] = future
+        if claimed:
+            try:
+                results = list(fn(claimed))
+                if len(results) != len(claimed):
+                    # Unresolved futures would leave every waiter on those keys blocked forever
+                    raise ValueError(f"do_many expected {len(claimed)} results, got {len(results)}")
+            except BaseException as e:
+                for i in claimed:
+                    futures[keys[i]].set_exception(e)
+                raise
+            finally:
+                with self.lock:
+                    for i in claimed:
+                        del self.calls[keys[i]]
+            for i, result in zip(claimed, results):
+                futures[keys[i]].set_result(result)
+        return [futures[key].result() for key in keys]
+
+    def stats(self) -> dict:
+        total = self.executed + self.shared
+        return {"executed": self.executed, "shared": self.shared, "shared_rate": self.shared / total if total else 0.0}
@@ -1,5 +1,7 @@
-import modal
+from typing import List, Optional
 from PaperAgent.agents.agent import Agent
+from PaperAgent.agents.metrics import timed
+from PaperAgent.agents.batching import MicroBatcher
 
 
 class SpecialistAgent(Agent):
@@ -10,20 +12,53 @@ class SpecialistAgent(Agent):
     name = "Specialist Agent"
     color = Agent.RED
 
-    def __init__(self):
+    def __init__(self, pricer=None, batch_endpoint: Optional[str] = None, max_batch_size: int = 32,
+                 max_wait: float = 0.02):
         """
         Set up this Agent by creating an instance of the modal class
+        :param pricer: use this object instead of connecting to Modal, e.g. an in-process stand-in
+            whose methods offer the same .remote/.map interface
+        :param batch_endpoint: the name of a method on the pricer that takes a list of descriptions;
+            without one, batches are dispatched with .map on the price method
+        :param max_batch_size: the most concurrent calls sent in one batch
+        :param max_wait: how long, in seconds, a call waits for others to join its batch
         """
         self.log("Specialist Agent is initializing - connecting to modal")
-        Pricer = modal.Cls.from_name("pricer-service", "Pricer")
-        self.pricer = Pricer()
+        if pricer is None:
+            import modal
+            Pricer = modal.Cls.from_name("pricer-service", "Pricer")
+            pricer = Pricer()
+        self.pricer = pricer
+        self.batch_endpoint = batch_endpoint
+        self.batcher = MicroBatcher(self.price_batch, max_batch_size=max_batch_size, max_wait=max_wait)
         self.log("Specialist Agent is ready")
+
+    @timed
+    def price_batch(self, descriptions: List[str]) -> List[float]:
+        """
+        One batched remote invocation for a list of descriptions
+        """
+        self.log("Specialist Agent is calling remote fine-tuned model with a batch of %d", len(descriptions))
+        if self.batch_endpoint:
+            return list(getattr(self.pricer, self.batch_endpoint).remote(descriptions))
+        return list(self.pricer.price.map(descriptions))
         
     def price(self, description: str) -> float:
         """
-        Make a remote call to return the estimate of the price of this item
+        Return the estimate of the price of this item
+        Concurrent calls are gathered by the micro-batcher into one remote invocation
+        """
+        result = self.batcher(description)
+        self.log("Specialist Agent completed - predicting $%.2f", result)
+        return result
+
+    def price_many(self, descriptions: List[str]) -> List[float]:
+        """
+        Estimate many items, in batches of at most max_batch_size
         """
-        self.log("Specialist Agent is calling remote fine-tuned model")
-        result = self.pricer.price.remote(description)
-        self.log(f"Specialist Agent completed - predicting ${result:.2f}")
-        return result
\ No newline at end of file
+        size = self.batcher.max_batch_size
+        return [
+            result
+            for start in range(0, len(descriptions), size)
+            for result in self.price_batch(descriptions[start:start + size])
+        ]
@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+
+from PaperAgent.agents.embeddings import DIMENSIONS
+
+
+class VectorIndex:
+    """
+    An in-process nearest-neighbour index over embeddings, with the same add/query interface
+    as a Chroma collection so FrontierAgent can use either
+    Vectors are L2-normalized and kept in a memory-mapped float32 matrix; documents and metadata
+    (e.g. citation counts) in a JSON-lines sidecar. Search is exact brute force by default;
+    build_ivf() switches to an inverted-file index that only scans the closest clusters
+    """
+
+    GROWTH = 8192
+    CHUNK = 65536
+
+    def __init__(self, directory: str, dimensions: int = DIMENSIONS):
+        self.directory = directory
+        self.dimensions = dimensions
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.records_path = os.path.join(directory, "records.jsonl")
+        self.centroids_path = os.path.join(directory, "centroids.npy")
+        self.assignments_path = os.path.join(directory, "assignments.i32")
+        self.lock = threading.RLock()
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict] = []
+        if os.path.exists(self.records_path):
+            with open(self.records_path) as f:
+                for line in f:
+                    record = json.loads(line)
+                    self.ids.append(record["id"])
+                    self.documents.append(record["document"])
+                    self.metadatas.append(record["metadata"])
+        self.vectors = None
+        self._open(max(self.GROWTH, len(self.ids)))
+        self.centroids = None
+        self.lists: Optional[List[np.ndarray]] = None
+        if os.path.exists(self.centroids_path) and os.path.exists(self.assignments_path):
+            self.centroids = np.load(self.centroids_path)
+            assignments = np.fromfile(self.assignments_path, dtype=np.int32)[:len(self.ids)]
+            self._build_lists(assignments)
+
+    def _open(self, capacity: int) -> None:
+        if self.vectors is not None:
+            self.vectors.flush()
+        size = capacity * self.dimensions * 4
+        with open(self.vectors_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self.capacity = capacity
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimensions))
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def add(self, ids: List[str], embeddings, documents: Optional[List[str]] = None,
+            metadatas: Optional[List[Dict]] = None) -> None:
+        """
+        Append vectors with their documents and metadata; existing data is never rewritten
+        """
+        vectors = self._normalize(embeddings)
+        documents = documents or [""] * len(ids)
+        metadatas = metadatas or [{} for _ in ids]
+        with self.lock:
+            start = len(self.ids)
+            if start + len(ids) > self.capacity:
+                self._open(max(start + len(ids), self.capacity + self.GROWTH))
+            self.vectors[start:start + len(ids)] = vectors
+            self.vectors.flush()
+            with open(self.records_path, "a") as f:
+                for id, document, metadata in zip(ids, documents, metadatas):
+                    f.write(json.dumps({"id": id, "document": document, "metadata": metadata}) + "\n")
+            self.ids.extend(ids)
+            self.documents.extend(documents)
+            self.metadatas.extend(metadatas)
+            if self.centroids is not None:
+                assignments = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+                with open(self.assignments_path, "ab") as f:
+                    assignments.tofile(f)
+                for row, cluster in enumerate(assignments, start):
+                    self.lists[cluster] = np.append(self.lists[cluster], row)
+
+    def _build_lists(self, assignments: np.ndarray) -> None:
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def build_ivf(self, n_lists: Optional[int] = None, iterations: int = 10, seed: int = 42) -> None:
+        """
+        Cluster the vectors with spherical k-means and search only the closest clusters from now on
+        :param n_lists: number of clusters; defaults to about sqrt(count)
+        """
+        with self.lock:
+            n = len(self.ids)
+            n_lists = min(n, n_lists or max(1, int(np.sqrt(n))))
+            data = np.asarray(self.vectors[:n])
+            rng = np.random.default_rng(seed)
+            centroids = data[rng.choice(n, n_lists, replace=False)].copy()
+            for _ in range(iterations):
+                assignments = np.argmax(data @ centroids.T, axis=1)
+                for cluster in range(n_lists):
+                    members = data[assignments == cluster]
+                    if len(members):
+                        centroids[cluster] = members.mean(axis=0)
+                centroids = self._normalize(centroids)
+            assignments = np.argmax(data @ centroids.T, axis=1).astype(np.int32)
+            self.centroids = centroids
+            np.save(self.centroids_path, centroids)
+            assignments.tofile(self.assignments_path)
+            self._build_lists(assignments)
+
+    def _search_flat(self, queries: np.ndarray, k: int):
+        n = len(self.ids)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, n, self.CHUNK):
+            block = np.asarray(self.vectors[start:min(n, start + self.CHUNK)])
+            scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+            rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))], axis=1)
+            keep = min(k, scores.shape[1])
+            top = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_rows = np.take_along_axis(rows, top, axis=1)
+        return best_scores, best_rows
+
+    def _search_ivf(self, queries: np.ndarray, k: int, n_probe: int):
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :n_probe]
+        all_scores, all_rows = [], []
+        for query, clusters in zip(queries, probes):
+            rows = np.sort(np.concatenate([self.lists[cluster] for cluster in clusters]))
+            scores = np.asarray(self.vectors[rows]) @ query
+            keep = min(k, len(rows))
+            top = np.argpartition(-scores, keep - 1)[:keep] if keep else np.zeros(0, dtype=np.int64)
+            all_scores.append(scores[top])
+            all_rows.append(rows[top])
+        return all_scores, all_rows
+
+    def query(self, query_embeddings, n_results: int = 5, n_probe: int = 8) -> Dict[str, List]:
+        """
+        Find the n_results nearest neighbours of each query embedding, in one batch
+        :param n_probe: in IVF mode, how many of the closest clusters to scan
+        :return: Chroma-style results: lists of ids, documents, metadatas and cosine distances per query
+        """
+        queries = self._normalize(query_embeddings)
+        with self.lock:
+            if not self.ids:
+                empty = [[] for _ in queries]
+                return {"ids": empty, "documents": empty, "metadatas": empty, "distances": empty}
+            if self.centroids is not None:
+                scores, rows = self._search_ivf(queries, n_results, min(n_probe, len(self.centroids)))
+            else:
+                scores, rows = self._search_flat(queries, n_results)
+            results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+            for query_scores, query_rows in zip(scores, rows):
+                order = np.argsort(-np.asarray(query_scores))
+                ranked = [int(query_rows[i]) for i in order]
+                results["ids"].append([self.ids[row] for row in ranked])
+                results["documents"].append([self.documents[row] for row in ranked])
+                results["metadatas"].append([self.metadatas[row] for row in ranked])
+                results["distances"].append([float(1 - query_scores[i]) for i in order])
+            return results
+
+    @classmethod
+    def from_collection(cls, collection, directory: str, batch_size: int = 5000) -> "VectorIndex":
+        """
+        Copy every vector, document and metadata out of a Chroma collection into a new index
+        """
+        index = cls(directory)
+        total = collection.count()
+        for offset in range(0, total, batch_size):
+            batch = collection.get(offset=offset, limit=batch_size, include=["embeddings", "documents", "metadatas"])
+            index.add(batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"])
+        return index
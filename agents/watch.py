@@ -0,0 +1,81 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from PaperAgent.agents.papers import Paper
+
+
+class WatermarkStore:
+    """
+    Persist a high-water mark per query: the newest publication date seen,
+    and the ids of the papers seen on that date
+    """
+
+    def __init__(self, path: str = "cache/watermarks.sqlite"):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS watermarks ("
+            "query TEXT PRIMARY KEY, latest_date TEXT, paper_ids TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def _normalize(query: str) -> str:
+        return " ".join(query.split()).lower()
+
+    def get(self, query: str) -> Tuple[Optional[str], List[str]]:
+        """
+        :return: (latest_date, paper ids seen on that date); (None, []) for a query never polled
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT latest_date, paper_ids FROM watermarks WHERE query = ?", (self._normalize(query),)
+            ).fetchone()
+        if row is None:
+            return None, []
+        return row[0], json.loads(row[1])
+
+    def advance(self, query: str, papers: List[Paper]) -> None:
+        """
+        Move the mark forward past these newly fetched papers
+        """
+        latest_date, paper_ids = self.get(query)
+        dated = [paper for paper in papers if paper.publication_date]
+        newest = max((paper.publication_date for paper in dated), default=None)
+        if newest and (latest_date is None or newest > latest_date):
+            latest_date, paper_ids = newest, []
+        paper_ids = sorted(set(paper_ids) | {
+            paper.paper_id for paper in papers
+            if paper.paper_id and (latest_date is None or paper.publication_date in (None, latest_date))
+        })
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO watermarks (query, latest_date, paper_ids, updated) VALUES (?, ?, ?, ?)",
+                (self._normalize(query), latest_date, json.dumps(paper_ids), time.time()),
+            )
+            self.conn.commit()
+
+
+# RUN: python -m PaperAgent.agents.watch "new results in diffusion models" --interval 3600
+if __name__ == "__main__":
+    from PaperAgent.agents.planning_agent import PlanningAgent
+
+    parser = argparse.ArgumentParser(description="Poll for new papers on a topic and surface only the new ones")
+    parser.add_argument("request", help="the free-form user request to watch")
+    parser.add_argument("--interval", type=float, default=3600, help="seconds between polls")
+    parser.add_argument("--iterations", type=int, default=None, help="stop after this many polls")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    planner = PlanningAgent([])
+    for papers in planner.watch(args.request, interval=args.interval, iterations=args.iterations):
+        for paper in papers:
+            print(paper.describe())
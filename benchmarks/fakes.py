@@ -0,0 +1,351 @@
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+
+from PaperAgent.agents.embeddings import DIMENSIONS
+
+WORDS = (
+    "learning neural network language model transformer attention graph agent reinforcement policy "
+    "retrieval embedding diffusion image vision robot planning reasoning benchmark dataset evaluation "
+    "optimization gradient sparse quantization inference latency memory compiler hardware accelerator "
+    "federated privacy security adversarial robustness causal generative synthesis protein molecule "
+    "climate energy scheduling distributed database query index compression streaming recommendation"
+).split()
+
+
+class Profile:
+    """
+    How a fake service behaves: its latency per call, and how often a call fails or is throttled
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, seed: int = 42):
+        """
+        :param latency: mean seconds per call
+        :param jitter: the latency is drawn uniformly from latency +/- jitter
+        :param error_rate: fraction of calls that fail outright (HTTP 500, or an exception)
+        :param throttle_rate: fraction of calls rejected as rate limited (HTTP 429)
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.throttles = 0
+
+    def fault(self) -> Optional[str]:
+        """
+        Count a call and decide whether it fails: "error", "throttle" or None
+        """
+        with self.lock:
+            self.calls += 1
+            draw = self.random.random()
+            if draw < self.throttle_rate:
+                self.throttles += 1
+                return "throttle"
+            if draw < self.throttle_rate + self.error_rate:
+                self.errors += 1
+                return "error"
+            return None
+
+    def wait(self) -> None:
+        with self.lock:
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter) if self.jitter else self.latency
+        if delay > 0:
+            time.sleep(delay)
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "errors": self.errors, "throttles": self.throttles}
+
+
+class FakeAPIError(RuntimeError):
+    status_code = 500
+
+
+class FakeRateLimitError(FakeAPIError):
+    status_code = 429
+
+
+def make_corpus(size: int, seed: int = 42) -> List[Dict]:
+    """
+    Synthetic Semantic Scholar search records, newest first; about one in ten has no abstract
+    """
+    rng = random.Random(seed)
+    records = []
+    for i in range(size):
+        day = i // 20
+        year = 2025 - day // 365
+        abstract = " ".join(rng.choice(WORDS) for _ in range(rng.randint(60, 180))) if rng.random() > 0.1 else None
+        records.append({
+            "paperId": f"{zlib.crc32(str(i).encode()):08x}{i:06d}",
+            "title": " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 10))).title(),
+            "abstract": abstract,
+            "year": year,
+            "publicationDate": f"{year}-{12 - (day // 30) % 12:02d}-{28 - day % 28:02d}",
+            "url": f"https://www.semanticscholar.org/paper/{i}",
+            "citationCount": int(rng.paretovariate(1.2)) - 1,
+            "externalIds": {},
+        })
+    return records
+
+
+class FakeSemanticScholar:
+    """
+    A local HTTP server answering /graph/v1/paper/search from a synthetic corpus
+    Throttled calls get a 429 with a Retry-After header, failed ones a 500
+    """
+
+    def __init__(self, corpus: List[Dict], profile: Optional[Profile] = None, retry_after: float = 0.05):
+        self.corpus = corpus
+        self.profile = profile or Profile()
+        self.retry_after = retry_after
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != "/graph/v1/paper/search":
+                    self.reply(404, {"error": "not found"})
+                    return
+                fault = service.profile.fault()
+                if fault == "throttle":
+                    self.reply(429, {"message": "Too Many Requests"}, {"Retry-After": str(service.retry_after)})
+                    return
+                service.profile.wait()
+                if fault == "error":
+                    self.reply(500, {"message": "Internal Server Error"})
+                    return
+                params = parse_qs(url.query)
+                offset = int(params.get("offset", ["0"])[0])
+                limit = int(params.get("limit", ["100"])[0])
+                data = service.corpus[offset:offset + limit]
+                self.reply(200, {"total": len(service.corpus), "offset": offset, "data": data})
+
+            def reply(self, status: int, payload: dict, headers: Optional[dict] = None):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True, name="fake-semantic-scholar")
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/graph/v1/paper/search"
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# One paper as written into a prompt by Paper.describe
+_DESCRIBED = re.compile(
+    r"^\s*Title: (.*)\n\s*Citations: (-?\d+)\n\s*Abstract: (.*)\n\s*Published: (.*)\n\s*paper ID: (\S*).*\n\s*URL: (.*)$",
+    re.MULTILINE,
+)
+
+
+def _response(content: Optional[str], prompt: str, parsed=None):
+    usage = SimpleNamespace(prompt_tokens=len(prompt) // 4 + 1, completion_tokens=len(content or "") // 4 + 1)
+    message = SimpleNamespace(content=content, parsed=parsed)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+class FakeOpenAI:
+    """
+    An OpenAI-compatible client with the chat.completions.create and beta.chat.completions.parse calls the agents use
+    Completions answer price prompts with a number and anything else with a short query;
+    structured parses answer index selections with k indices taken from the prompt,
+    and paper selections by echoing back up to `echo_k` of the papers described in it
+    Answers are deterministic for a given prompt
+    """
+
+    def __init__(self, profile: Optional[Profile] = None, echo_k: int = 20):
+        self.profile = profile or Profile()
+        self.echo_k = echo_k
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self.parse)))
+
+    def _call(self) -> None:
+        fault = self.profile.fault()
+        if fault == "throttle":
+            raise FakeRateLimitError("429 Too Many Requests")
+        self.profile.wait()
+        if fault == "error":
+            raise FakeAPIError("500 Internal Server Error")
+
+    @staticmethod
+    def _prompt(messages: List[Dict[str, str]]) -> str:
+        return "\n".join(str(message["content"]) for message in messages)
+
+    def create(self, model: str, messages: List[Dict[str, str]], **params):
+        self._call()
+        prompt = self._prompt(messages)
+        rng = random.Random(zlib.crc32(prompt.encode("utf-8")))
+        if messages[-1]["role"] == "assistant":
+            content = f"{rng.uniform(0, 500):.2f}"
+        else:
+            content = " ".join(messages[-1]["content"].split()[:8])
+        return _response(content, prompt)
+
+    def parse(self, model: str, messages: List[Dict[str, str]], response_format, **params):
+        self._call()
+        prompt = self._prompt(messages)
+        rng = random.Random(zlib.crc32(prompt.encode("utf-8")))
+        indices = [int(index) for index in re.findall(r"^\s*\[(\d+)\]", prompt, re.MULTILINE)]
+        if indices:
+            match = re.search(r"Return exactly (\d+) items", prompt)
+            k = min(len(indices), int(match.group(1)) if match else 20)
+            choices = [{"index": index, "score": round(rng.random(), 3)} for index in rng.sample(indices, k)]
+        else:
+            # "papers" mode: echo whole papers back, as the real model is asked to
+            described = _DESCRIBED.findall(prompt)
+            choices = [
+                {"title": title, "citations": int(citations), "abstract": abstract,
+                 "published": None if published == "N/A" else published,
+                 "paper_id": None if paper_id == "N/A" else paper_id, "url": url, "score": round(rng.random(), 3)}
+                for title, citations, abstract, published, paper_id, url
+                in rng.sample(described, min(len(described), self.echo_k))
+            ]
+        parsed = response_format.model_validate({"papers": choices})
+        return _response(json.dumps({"papers": choices}), prompt, parsed)
+
+
+class FakeEncoder:
+    """
+    A SentenceTransformer stand-in: hashed bag-of-words vectors, so texts sharing words are similar
+    """
+
+    def __init__(self, profile: Optional[Profile] = None, dimensions: int = DIMENSIONS):
+        self.profile = profile or Profile()
+        self.dimensions = dimensions
+
+    def encode(self, texts, batch_size: int = 64, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        for _ in range(0, len(texts), batch_size):
+            self.profile.wait()
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                h = zlib.crc32(word.encode("utf-8"))
+                vectors[row, h % self.dimensions] += 1.0 if h & 0x80000000 else -1.0
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors[0] if single else vectors
+
+
+class _RemoteMethod:
+    def __init__(self, fn, profile: Profile):
+        self.fn = fn
+        self.profile = profile
+
+    def _call(self) -> None:
+        fault = self.profile.fault()
+        self.profile.wait()
+        if fault is not None:
+            raise FakeAPIError(f"remote call failed ({fault})")
+
+    def remote(self, argument):
+        self._call()
+        return self.fn(argument)
+
+    def map(self, arguments):
+        self._call()
+        return [self.fn(argument) for argument in arguments]
+
+
+class FakePricer:
+    """
+    A Modal Pricer stand-in with .price.remote/.price.map, and a batched .price_batch.remote
+    Each remote invocation costs one latency, however many items it carries
+    """
+
+    def __init__(self, profile: Optional[Profile] = None):
+        self.profile = profile or Profile()
+        self.price = _RemoteMethod(self.estimate, self.profile)
+        self.price_batch = _RemoteMethod(lambda descriptions: [self.estimate(d) for d in descriptions], self.profile)
+
+    @staticmethod
+    def estimate(description: str) -> float:
+        return float(zlib.crc32(description.encode("utf-8")) % 50_000) / 100
+
+
+class FakeRegressor:
+    """
+    A fitted-regressor stand-in for the random forest: a fixed linear map of the embedding
+    """
+
+    def __init__(self, dimensions: int = DIMENSIONS, seed: int = 42):
+        self.weights = np.random.default_rng(seed).normal(0, 50, dimensions).astype(np.float32)
+
+    def predict(self, X) -> np.ndarray:
+        return np.asarray(X, dtype=np.float32) @ self.weights + 100.0
+
+
+class FakePushover:
+    """
+    Stands in for the Pushover connection pool: request() returns an HTTP status and records the message
+    """
+
+    def __init__(self, profile: Optional[Profile] = None):
+        self.profile = profile or Profile()
+        self.sent = 0
+        self.lock = threading.Lock()
+
+    def request(self, method: str, path: str, body: str, headers: dict) -> int:
+        fault = self.profile.fault()
+        self.profile.wait()
+        if fault == "throttle":
+            return 429
+        if fault == "error":
+            return 500
+        with self.lock:
+            self.sent += 1
+        return 200
+
+    def close(self) -> None:
+        pass
+
+
+class FakeChroma:
+    """
+    Wraps an in-process index (e.g. a VectorIndex) with the latency and failures of a remote Chroma server
+    """
+
+    def __init__(self, collection, profile: Optional[Profile] = None):
+        self.collection = collection
+        self.profile = profile or Profile()
+
+    def query(self, query_embeddings, n_results: int = 5, **kwargs):
+        fault = self.profile.fault()
+        self.profile.wait()
+        if fault is not None:
+            raise FakeAPIError(f"chroma query failed ({fault})")
+        return self.collection.query(query_embeddings=query_embeddings, n_results=n_results)
+
+    def count(self) -> int:
+        return self.collection.count()
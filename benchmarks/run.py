@@ -0,0 +1,292 @@
+"""
+Offline end-to-end benchmarks: every external service is replaced by a local fake with configurable
+latency, error and 429 rates, so runs are reproducible and cost nothing
+benchmarks/baseline.json holds a run of every scenario with the default profile; timings depend on the machine,
+so save a fresh baseline before comparing on different hardware
+
+RUN: python -m PaperAgent.benchmarks.run --sizes 50 1000 10000 --save-baseline benchmarks/baseline.json
+     python -m PaperAgent.benchmarks.run --baseline benchmarks/baseline.json
+"""
+import argparse
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from PaperAgent.benchmarks.fakes import (FakeChroma, FakeEncoder, FakeOpenAI, FakePricer, FakePushover,
+                                         FakeRegressor, FakeSemanticScholar, Profile, make_corpus)
+
+SCENARIOS = ("fetch", "scan", "scan_papers", "evaluate", "evaluate_many", "plan")
+SIZES = (50, 1000, 10000)
+SERVICES = ("semantic_scholar", "openai", "modal", "chroma", "embeddings", "pushover")
+# Default latency per call, in seconds, of each fake service
+LATENCIES = {"semantic_scholar": 0.05, "openai": 0.02, "modal": 0.05, "chroma": 0.005, "embeddings": 0.0,
+             "pushover": 0.01}
+QUERY = "recent advances in language model reasoning and retrieval"
+
+
+class OfflineServices:
+    """
+    Start the fakes for one corpus size and point the agents at them
+    """
+
+    def __init__(self, size: int, profiles: Dict[str, Profile], rps: float, directory: str):
+        from PaperAgent.agents import papers
+        from PaperAgent.agents.embeddings import EmbeddingService, set_embedding_service
+        from PaperAgent.agents.llm_cache import set_llm_cache
+        from PaperAgent.agents.rate_limiter import TokenBucket
+        from PaperAgent.agents.vector_index import VectorIndex
+
+        self.profiles = profiles
+        self.corpus = make_corpus(size)
+        self.semantic_scholar = FakeSemanticScholar(self.corpus, profiles["semantic_scholar"])
+        papers.BASE_URL = self.semantic_scholar.url
+        papers.RATE_LIMITER = TokenBucket(rate=rps, capacity=rps)
+        # Measure cold paths: nothing is served from the on-disk caches
+        papers.set_response_cache(None)
+        set_llm_cache(None)
+        self.encoder = FakeEncoder(profiles["embeddings"])
+        set_embedding_service(EmbeddingService(model_name="fake-hashing", encoder=self.encoder))
+        self.openai = FakeOpenAI(profiles["openai"])
+        self.pricer = FakePricer(profiles["modal"])
+        self.pushover = FakePushover(profiles["pushover"])
+
+        records = [record for record in self.corpus if record["abstract"]]
+        documents = [papers.Paper.from_api(record).make_model_input() for record in records]
+        index = VectorIndex(directory)
+        index.add([record["paperId"] for record in records], FakeEncoder().encode(documents), documents,
+                  [{"price": float(max(0, record["citationCount"]))} for record in records])
+        self.collection = FakeChroma(index, profiles["chroma"])
+        self.descriptions = documents
+
+    def scanner(self, selection_mode: str = "indices"):
+        from PaperAgent.agents.scanner_agent import ScannerAgent
+        return ScannerAgent(client=self.openai, selection_mode=selection_mode)
+
+    def evaluator(self):
+        from PaperAgent.agents.evaluate_agent import EvaluateAgent
+        from PaperAgent.agents.frontier_agent import FrontierAgent
+        from PaperAgent.agents.random_forest_agent import RandomForestAgent
+        from PaperAgent.agents.specialist_agent import SpecialistAgent
+        return EvaluateAgent(
+            self.collection,
+            specialist=SpecialistAgent(pricer=self.pricer),
+            frontier=FrontierAgent(self.collection, client=self.openai),
+            random_forest=RandomForestAgent(model=FakeRegressor()),
+        )
+
+    def messenger(self):
+        from PaperAgent.agents.messaging_agent import MessagingAgent
+        return MessagingAgent(pool=self.pushover, rate=100.0)
+
+    def planner(self, pages: int):
+        from PaperAgent.agents.planning_agent import PlanningAgent
+        return PlanningAgent(self.collection, use_evaluator=True, remember=False, notify=True, pages=pages,
+                             scanner=self.scanner(), evaluator=self.evaluator(), messenger=self.messenger())
+
+    def close(self) -> None:
+        self.semantic_scholar.close()
+
+
+def _timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def run_fetch(services: OfflineServices, size: int, repeat: int, samples: int) -> Tuple[List[float], int]:
+    from PaperAgent.agents.papers import Paper
+    latencies, items = [], 0
+    for _ in range(repeat):
+        for page in range(math.ceil(size / 100)):
+            result = []
+            latencies.append(_timed(lambda: result.extend(Paper.fetch(QUERY, page, limit=100, use_cache=False))))
+            items += len(result)
+    return latencies, items
+
+
+def run_scan(services: OfflineServices, size: int, repeat: int, samples: int) -> Tuple[List[float], int]:
+    scanner = services.scanner()
+    pages = math.ceil(size / 50)
+    latencies = [_timed(lambda: scanner.scan(memory=None, user_request=QUERY, pages=pages)) for _ in range(repeat)]
+    return latencies, size * repeat
+
+
+def run_scan_papers(services: OfflineServices, size: int, repeat: int, samples: int) -> Tuple[List[float], int]:
+    """
+    The scan with the LLM echoing back whole papers instead of their indices
+    """
+    scanner = services.scanner(selection_mode="papers")
+    pages = math.ceil(size / 50)
+    latencies = [_timed(lambda: scanner.scan(memory=None, user_request=QUERY, pages=pages)) for _ in range(repeat)]
+    return latencies, size * repeat
+
+
+def run_evaluate(services: OfflineServices, size: int, repeat: int, samples: int) -> Tuple[List[float], int]:
+    evaluator = services.evaluator()
+    descriptions = services.descriptions[:min(size, samples)]
+    latencies = [_timed(lambda: evaluator.evaluate(description)) for _ in range(repeat) for description in descriptions]
+    return latencies, len(latencies)
+
+
+def run_evaluate_many(services: OfflineServices, size: int, repeat: int, samples: int) -> Tuple[List[float], int]:
+    evaluator = services.evaluator()
+    descriptions = services.descriptions[:size]
+    latencies = [_timed(lambda: evaluator.evaluate_many(descriptions)) for _ in range(repeat)]
+    return latencies, len(descriptions) * repeat
+
+
+def run_plan(services: OfflineServices, size: int, repeat: int, samples: int) -> Tuple[List[float], int]:
+    planner = services.planner(pages=math.ceil(size / 50))
+
+    def plan():
+        planner.plan(memory=[], user_request=QUERY)
+        planner.messenger.flush()
+
+    latencies = [_timed(plan) for _ in range(repeat)]
+    return latencies, size * repeat
+
+
+RUNNERS = {
+    "fetch": run_fetch,
+    "scan": run_scan,
+    "scan_papers": run_scan_papers,
+    "evaluate": run_evaluate,
+    "evaluate_many": run_evaluate_many,
+    "plan": run_plan,
+}
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(scenario: str, size: int, options: dict) -> dict:
+    """
+    Run one scenario at one corpus size, normally in a fresh process so peak RSS is its own
+    """
+    profiles = {
+        service: Profile(latency=options["latency"][service], jitter=options["jitter"] * options["latency"][service],
+                         error_rate=options["error_rate"], throttle_rate=options["throttle_rate"])
+        for service in SERVICES
+    }
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, "w") as devnull:
+        services = OfflineServices(size, profiles, options["rps"], directory)
+        try:
+            # papers.py reports progress with print
+            with contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                latencies, items = RUNNERS[scenario](services, size, options["repeat"], options["samples"])
+                elapsed = time.perf_counter() - start
+        finally:
+            services.close()
+    return {
+        "scenario": scenario,
+        "size": size,
+        "ops": len(latencies),
+        "items": items,
+        "seconds": elapsed,
+        "throughput": items / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "peak_rss_mb": peak_rss_mb(),
+        "faults": {service: profile.stats() for service, profile in profiles.items()},
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    :return: a description of every case whose throughput fell, or whose p50/p99 latency rose, by more than tolerance
+    """
+    regressions = []
+    for key, result in results.items():
+        before = baseline.get(key)
+        if before is None:
+            continue
+        if before["throughput"] and result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {before['throughput']:.1f} -> {result['throughput']:.1f} items/s")
+        for metric in ("p50", "p99"):
+            if before[metric] and result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{key}: {metric} {before[metric] * 1000:.1f} -> {result[metric] * 1000:.1f} ms")
+    return regressions
+
+
+def report(results: Dict[str, dict], baseline: Dict[str, dict]) -> None:
+    print(f"{'case':<22}{'ops':>6}{'items/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'rss MB':>9}{'vs base':>10}")
+    for key, result in results.items():
+        before = baseline.get(key)
+        change = ""
+        if before and before["throughput"]:
+            change = f"{(result['throughput'] / before['throughput'] - 1) * 100:+.0f}%"
+        print(f"{key:<22}{result['ops']:>6}{result['throughput']:>12.1f}{result['p50'] * 1000:>10.1f}"
+              f"{result['p99'] * 1000:>10.1f}{result['peak_rss_mb']:>9.0f}{change:>10}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the agents against local fakes of every external service")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(SIZES), help="corpus sizes, in papers")
+    parser.add_argument("--repeat", type=int, default=3, help="how many times each scenario runs")
+    parser.add_argument("--samples", type=int, default=50, help="papers evaluated one at a time in the evaluate scenario")
+    for service in SERVICES:
+        parser.add_argument(f"--{service.replace('_', '-')}-latency", type=float, default=LATENCIES[service],
+                            dest=f"{service}_latency", help=f"seconds per {service} call")
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency jitter, as a fraction of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls to every service that fail")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of calls to every service that get a 429")
+    parser.add_argument("--rps", type=float, default=1000.0, help="Semantic Scholar rate limit for the run")
+    parser.add_argument("--baseline", help="compare against the results saved in this JSON file")
+    parser.add_argument("--save-baseline", help="save the results to this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fractional change before a regression")
+    parser.add_argument("--in-process", action="store_true", help="run every case in this process, e.g. for profiling")
+    args = parser.parse_args(argv)
+
+    options = {
+        "latency": {service: getattr(args, f"{service}_latency") for service in SERVICES},
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+        "rps": args.rps,
+        "repeat": args.repeat,
+        "samples": args.samples,
+    }
+    results = {}
+    for scenario in args.scenarios:
+        for size in args.sizes:
+            if args.in_process:
+                result = run_case(scenario, size, options)
+            else:
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    result = executor.submit(run_case, scenario, size, options).result()
+            results[f"{scenario}@{size}"] = result
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    report(results, baseline)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"options": options, "results": results}, f, indent=2)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"[REGRESSION] {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())